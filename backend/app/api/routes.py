@@ -1,19 +1,198 @@
 # Corrected version of app/api/routes.py
 
-from fastapi import APIRouter
+import os
+from typing import List, Literal, Optional
+
+import orjson
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from app.models.concept import ConceptRequest, ConceptResponse
-from app.services.gemini_client import generate_concept_visualization
+from app.services.cache import visualization_cache
+from app.services.deadline import REQUEST_DEADLINE_SECONDS, deadline_after
+from app.services.encoding import egress_stats, encode_visualization, make_etag, matching_etag
+from app.services.errors import GeminiError
+from app.services.gemini_client import is_cacheable
+from app.services.hedging import gemini_hedger
+from app.services.prefetch import prefetcher
+from app.services.prompts import prompt_stats
+from app.services.rate_limit import gemini_rate_limiter
+from app.services.resilience import gemini_breaker
+from app.services.semantic_cache import semantic_index
+from app.services.singleflight import visualization_flight
+from app.services.visualizer import (
+    get_visualization,
+    get_visualizations,
+    stream_visualization,
+)
+
+# Largest number of concepts accepted by one /visualize/batch call
+BATCH_MAX_ITEMS = 500
+# How long browsers and CDNs may reuse a GET /visualize/{concept} response before revalidating
+VISUALIZE_MAX_AGE = int(os.getenv("VISUALIZE_MAX_AGE", "3600"))
 
 router = APIRouter()
 
 
+def _observe(request: Request, concept: str):
+    """Log the request and, per client, which concept it followed."""
+    visualization_cache.record_request(concept)
+    client = request.headers.get("x-client-id") or (request.client.host if request.client else "")
+    prefetcher.observe_request(client, concept)
+
+
+def _deadline_seconds(body_ms: Optional[int], header_ms: Optional[int]) -> float:
+    """The tighter of the body's and the header's deadline, else the default."""
+    budgets = [ms for ms in (body_ms, header_ms) if ms and ms > 0]
+    return min(budgets) / 1000 if budgets else REQUEST_DEADLINE_SECONDS
+
+
 @router.post("/visualize", response_model=ConceptResponse)
-async def visualize_concept(concept_request: ConceptRequest):
+async def visualize_concept(
+    concept_request: ConceptRequest,
+    request: Request,
+    x_request_deadline_ms: Optional[int] = Header(None),
+):
+    _observe(request, concept_request.concept)
     # Call the service with the concept string from the request
-    result = await generate_concept_visualization(concept_request.concept)
+    deadline = _deadline_seconds(concept_request.deadline_ms, x_request_deadline_ms)
+    with deadline_after(deadline):
+        result = await get_visualization(concept_request.concept, concept_request.mode)
+
+    # The plan was validated as a VisualizationPlan when it was parsed, so
+    # serialize it once with orjson instead of rebuilding a ConceptResponse
+    return Response(encode_visualization(result), media_type="application/json")
+
+
+@router.get("/visualize/{concept:path}")
+async def visualize_concept_cacheable(
+    concept: str,
+    request: Request,
+    mode: Optional[Literal["two_step", "combined"]] = None,
+    format: Literal["full", "compact"] = "full",
+    if_none_match: Optional[str] = Header(None),
+    x_request_deadline_ms: Optional[int] = Header(None),
+):
+    """The /visualize plan as a cacheable GET, with a strong ETag.
 
-    # Correctly build the ConceptResponse using the keys from the result dictionary
-    # The 'result' dictionary contains "category" and "visualization"
-    return ConceptResponse(
-        category=result["category"], visualization=result["visualization"]
+    A client or CDN revalidating with If-None-Match gets a bodiless 304 while
+    the cached plan is unchanged. format=compact sends the elements as rows
+    (see encode_visualization).
+    """
+    _observe(request, concept)
+    with deadline_after(_deadline_seconds(None, x_request_deadline_ms)):
+        result = await get_visualization(concept, mode)
+
+    body = encode_visualization(result, compact=format == "compact")
+    if not is_cacheable(result):
+        # The placeholder (or a plan cut short) is not cached here, so nobody downstream may keep it
+        return Response(body, media_type="application/json", headers={"Cache-Control": "no-store"})
+    etag = make_etag(body)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={VISUALIZE_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+    matched = matching_etag(if_none_match, etag)
+    if matched is not None:
+        egress_stats.not_modified += 1
+        return Response(status_code=304, headers={**headers, "ETag": matched})
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.post("/visualize/stream")
+async def visualize_concept_stream(
+    concept_request: ConceptRequest,
+    request: Request,
+    x_request_deadline_ms: Optional[int] = Header(None),
+):
+    """Stream the plan as Server-Sent Events: category, title, layout,
+    interaction, one "element" event per element, then "done" with the full result.
+    """
+    _observe(request, concept_request.concept)
+    deadline = _deadline_seconds(concept_request.deadline_ms, x_request_deadline_ms)
+
+    async def events():
+        try:
+            with deadline_after(deadline):
+                async for event, data in stream_visualization(concept_request.concept):
+                    yield b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+        except GeminiError as e:
+            yield b"event: error\ndata: " + orjson.dumps({"detail": str(e)}) + b"\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+
+@router.post("/visualize/batch")
+async def visualize_concepts_batch(concept_requests: List[ConceptRequest]):
+    """Generate many plans, streaming one NDJSON line per concept as each finishes.
+
+    Lines carry the item's index in the request; failed items carry an "error"
+    instead of a visualization. Each item's deadline_ms applies from when that
+    item starts generating, not to the batch as a whole.
+    """
+    if len(concept_requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} concepts"
+        )
+    requests = [
+        (r.concept, r.mode, r.deadline_ms / 1000 if r.deadline_ms else None)
+        for r in concept_requests
+    ]
+    for concept, _, _ in requests:
+        visualization_cache.record_request(concept)
+
+    async def lines():
+        async for index, result in get_visualizations(requests):
+            line = {"index": index, "concept": requests[index][0]}
+            if isinstance(result, Exception):
+                line["error"] = str(result) or type(result).__name__
+            else:
+                line["category"] = result["category"]
+                line["visualization"] = result["visualization"]
+            yield orjson.dumps(line) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    return visualization_cache.stats()
+
+
+@router.get("/cache/semantic/stats")
+async def semantic_cache_stats():
+    return semantic_index.stats()
+
+
+@router.get("/prompts/stats")
+async def prompts_stats():
+    return prompt_stats()
+
+
+@router.get("/egress/stats")
+async def egress_stats_route():
+    return egress_stats.stats()
+
+
+@router.get("/prefetch/stats")
+async def prefetch_stats():
+    return prefetcher.stats()
+
+
+@router.get("/coalescing/stats")
+async def coalescing_stats():
+    return visualization_flight.stats()
+
+
+@router.get("/gemini/stats")
+async def gemini_stats():
+    return {
+        "circuit_breaker": gemini_breaker.stats(),
+        "rate_limiter": gemini_rate_limiter.stats(),
+        "hedging": gemini_hedger.stats(),
+    }
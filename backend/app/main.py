@@ -1,47 +1,178 @@
 import asyncio
+import atexit
 import logging
+import os
+import queue
+from contextlib import asynccontextmanager
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 
 import httpx
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
 
 from app.api.routes import router as api_router
+from app.services.cache import visualization_cache
+from app.services.classifier import get_classifier
+from app.services.encoding import CompressionMiddleware, egress_stats
+from app.services.errors import (
+    CircuitOpenError,
+    DeadlineExceededError,
+    GeminiError,
+    GeminiRateLimitError,
+)
+from app.services.hedging import gemini_hedger
+from app.services.http_client import close_http_client, start_http_client
+from app.services.leader import leader_lock
+from app.services.metrics import register_stats, register_stats_collectors
+from app.services.prefetch import prefetcher
+from app.services.rate_limit import gemini_rate_limiter
+from app.services.resilience import gemini_breaker
+from app.services.semantic_cache import semantic_index
+from app.services.singleflight import visualization_flight
+from app.services.visualizer import get_visualization
+from app.services.warmup import WARMUP_ON_STARTUP, warm_on_startup
+
+# Runtime configuration
+KEEP_ALIVE_URL = os.getenv("KEEP_ALIVE_URL", "https://concept-visualizer-z8xl.onrender.com")
+# How long shutdown waits for in-flight generations after the server stops taking requests
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+# Set by gunicorn.conf.py when several workers share one /metrics view
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def configure_logging() -> QueueListener:
+    """Route log records through a queue so request handlers never block on stdout."""
+    log_queue = queue.SimpleQueue()
+    # Records are formatted on the way into the queue; the listener just writes them
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+    )
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
 
 # Logger setup
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
-
-# Initialize FastAPI app
-app = FastAPI()
-
-# CORS setup
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "https://concept-visualizer-six.vercel.app",
-        "https://concept-visualizer-git-main-pratikpaudels-projects.vercel.app",
-        "https://concept-visualizer-nsulwlh9p-pratikpaudels-projects.vercel.app",
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+configure_logging()
+
+register_stats("visualization_cache", visualization_cache.stats)
+register_stats("coalescing", visualization_flight.stats)
+register_stats("gemini_breaker", gemini_breaker.stats)
+register_stats("gemini_rate_limiter", gemini_rate_limiter.stats)
+register_stats("semantic_cache", semantic_index.stats)
+register_stats("leader", leader_lock.stats)
+register_stats("gemini_hedging", gemini_hedger.stats)
+register_stats("egress", egress_stats.stats)
+register_stats("prefetch", prefetcher.stats)
 
 
-# Include API routes
-app.include_router(api_router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own the Gemini connection pool, caches and background jobs for the app lifetime."""
+    await start_http_client()
+    # Train the local classifier up front so the first request doesn't pay for it
+    get_classifier()
+    # Memory-map the semantic index snapshot now rather than on the first miss
+    semantic_index.load()
+    # Every worker starts this, but only the one holding the leader lock runs the jobs
+    jobs = [keep_alive] if KEEP_ALIVE_URL else []
+    if WARMUP_ON_STARTUP:
+        jobs.append(warm_on_startup)
+    background_task = asyncio.create_task(leader_lock.run(jobs)) if jobs else None
+    # Each worker prefetches after its own requests; returns at once when disabled
+    prefetch_task = asyncio.create_task(prefetcher.run(get_visualization))
+    try:
+        yield
+    finally:
+        if background_task is not None:
+            background_task.cancel()
+        prefetch_task.cancel()
+        # The server has stopped taking requests; let generations that callers
+        # are still waiting on finish and land in the cache before the pool closes
+        still_running = await visualization_flight.drain(SHUTDOWN_DRAIN_SECONDS)
+        if still_running:
+            logger.warning("shutdown_drain_timeout abandoned=%d", still_running)
+        await close_http_client()
+        await semantic_index.save()
+        visualization_cache.close()
+        leader_lock.release()
+
+
+async def gemini_error_handler(request: Request, exc: GeminiError):
+    """Report upstream failures as 503 when retrying later can help, 504 when the
+    request's deadline ran out, 502 otherwise."""
+    if isinstance(exc, DeadlineExceededError):
+        return JSONResponse(status_code=504, content={"detail": str(exc)})
+    if isinstance(exc, (CircuitOpenError, GeminiRateLimitError)):
+        headers = {}
+        if exc.retry_after is not None:
+            headers["Retry-After"] = str(max(1, round(exc.retry_after)))
+        return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=headers)
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
 
 
-@app.get("/")
 def root():
     return {"message": "Backend is live 🔥"}
 
 
+async def metrics():
+    # Runs on the event loop rather than in the threadpool: the stats() callbacks
+    # read state that request handlers change
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Under gunicorn, aggregate the counters and histograms of every worker
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        register_stats_collectors(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def create_app() -> FastAPI:
+    """Build the FastAPI app; the lifespan opens and closes its shared resources."""
+    app = FastAPI(lifespan=lifespan)
+
+    # CORS setup
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:3000",
+            "https://concept-visualizer-six.vercel.app",
+            "https://concept-visualizer-git-main-pratikpaudels-projects.vercel.app",
+            "https://concept-visualizer-nsulwlh9p-pratikpaudels-projects.vercel.app",
+        ],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Lets the frontend read the ETag it revalidates GET /visualize/{concept} with
+        expose_headers=["ETag"],
+    )
+    # Added last so it runs outermost and also compresses CORS and error responses
+    app.add_middleware(CompressionMiddleware)
+    app.add_exception_handler(GeminiError, gemini_error_handler)
+
+    # Include API routes
+    app.include_router(api_router)
+    app.add_api_route("/", root, methods=["GET"])
+    app.add_api_route("/metrics", metrics, methods=["GET"])
+    return app
+
+
 async def keep_alive():
-    """Background task to ping Render server and keep it awake."""
-    url = "https://concept-visualizer-z8xl.onrender.com"
+    """Background task to ping the Render server and keep it awake."""
+    url = KEEP_ALIVE_URL
     async with httpx.AsyncClient() as client:
         while True:
             try:
@@ -61,6 +192,5 @@ async def keep_alive():
                 await asyncio.sleep(30)
 
 
-@app.on_event("startup")
-async def on_startup():
-    asyncio.create_task(keep_alive())
+# Module-level app for `uvicorn app.main:app`; gunicorn uses the same object
+app = create_app()
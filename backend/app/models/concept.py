@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 
 
 class VisualizationElement(BaseModel):
@@ -13,11 +13,16 @@ class VisualizationPlan(BaseModel):
     title: str
     layout: Optional[str] = None
     interaction: Optional[str] = None
-    elements: List[VisualizationElement]
+    # A plan without elements has nothing to draw, typically output cut off at "elements": [
+    elements: List[VisualizationElement] = Field(min_length=1)
 
 
 class ConceptRequest(BaseModel):
     concept: str
+    # Overrides the PIPELINE_MODE deployment default for this request
+    mode: Optional[Literal["two_step", "combined"]] = None
+    # End-to-end budget in milliseconds; the X-Request-Deadline-Ms header works too
+    deadline_ms: Optional[int] = Field(None, gt=0)
 
 
 class ConceptResponse(BaseModel):
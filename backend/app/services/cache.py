@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+VIZ_CACHE_MAX_ENTRIES = int(os.getenv("VIZ_CACHE_MAX_ENTRIES", "1024"))
+VIZ_CACHE_TTL_SECONDS = float(os.getenv("VIZ_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+VIZ_CACHE_PATH = os.getenv("VIZ_CACHE_PATH", "cache/visualizations.sqlite3")
+# Request counts are buffered in memory and written once this many concepts are
+# pending or this many seconds have passed, whichever comes first
+VIZ_ACCESS_LOG_FLUSH_EVERY = int(os.getenv("VIZ_ACCESS_LOG_FLUSH_EVERY", "256"))
+VIZ_ACCESS_LOG_FLUSH_SECONDS = float(os.getenv("VIZ_ACCESS_LOG_FLUSH_SECONDS", "60"))
+# Seconds a disk operation waits on another worker's write lock before failing
+VIZ_CACHE_BUSY_TIMEOUT = float(os.getenv("VIZ_CACHE_BUSY_TIMEOUT", "5"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_concept(concept: str) -> str:
+    """Normalize a concept so trivially different spellings share a cache entry."""
+    return _WHITESPACE_RE.sub(" ", concept).strip(" \t\n.?!").lower()
+
+
+def make_cache_key(concept: str, namespace: str) -> str:
+    """Build a cache key from the normalized concept and the prompt/model namespace."""
+    raw = f"{namespace}\x00{normalize_concept(concept)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class VisualizationCache:
+    """Two-tier cache: a bounded in-process LRU in front of a SQLite store.
+
+    The SQLite file runs in WAL mode, so every uvicorn worker on the host can
+    share it and entries survive restarts. Both tiers honour the same TTL.
+    It also keeps an access log of how often each concept was requested,
+    independent of prompt version, which the cache warmer reads after a deploy,
+    and of which concept users asked for next, which the prefetcher follows.
+
+    Only the memory tier is used on the event loop. Disk reads run in the
+    default thread pool, each thread with its own connection; writes are
+    queued to a single writer thread and not waited for, so lock contention
+    between workers never stalls a request.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._readers = threading.local()
+        self._reader_dbs: List[sqlite3.Connection] = []
+        self._requested: Counter = Counter()
+        self._transitions: Counter = Counter()
+        self._flushed_at = time.monotonic()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(
+            self.path, timeout=VIZ_CACHE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS visualizations (
+                key TEXT PRIMARY KEY,
+                concept TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS concept_requests (
+                concept TEXT PRIMARY KEY,
+                requests INTEGER NOT NULL,
+                last_requested REAL NOT NULL
+            )
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS concept_transitions (
+                source TEXT NOT NULL,
+                target TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                PRIMARY KEY (source, target)
+            )
+            """
+        )
+        return db
+
+    def _connect(self) -> sqlite3.Connection:
+        """The writer's connection; only used on the writer thread."""
+        if self._db is None:
+            self._db = self._open()
+            self._db.execute("DELETE FROM visualizations WHERE expires_at < ?", (time.time(),))
+        return self._db
+
+    def _reader(self) -> sqlite3.Connection:
+        """This thread's read connection."""
+        db = getattr(self._readers, "db", None)
+        if db is None:
+            db = self._readers.db = self._open()
+            self._reader_dbs.append(db)
+        return db
+
+    async def _read(self, query: str, params: tuple) -> list:
+        def run():
+            return self._reader().execute(query, params).fetchall()
+
+        return await asyncio.to_thread(run)
+
+    def _write(self, fn, *args):
+        """Queue fn(db, *args) on the writer thread."""
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="viz-cache-writer")
+        self._writer.submit(lambda: fn(self._connect(), *args)).add_done_callback(self._written)
+
+    @staticmethod
+    def _written(future: Future):
+        if future.exception() is not None:
+            logger.warning("viz_cache_write_failed error=%r", str(future.exception()))
+
+    def _remember(self, key: str, value: dict, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _memory_get(self, key: str, now: float) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                return value
+            del self._memory[key]
+            self.expirations += 1
+        return None
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Return the cached result for key, checking memory first and then disk."""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        rows = await self._read("SELECT value, expires_at FROM visualizations WHERE key = ?", (key,))
+        if rows:
+            value_bytes, expires_at = rows[0]
+            if expires_at > now:
+                value = orjson.loads(value_bytes)
+                self._remember(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+            self._write(lambda db: db.execute("DELETE FROM visualizations WHERE key = ?", (key,)))
+            self.expirations += 1
+
+        self.misses += 1
+        return None
+
+    async def contains(self, key: str) -> bool:
+        """Whether key has a live entry, without touching the LRU order or the hit counters."""
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] > time.time():
+            return True
+        rows = await self._read(
+            "SELECT 1 FROM visualizations WHERE key = ? AND expires_at > ?", (key, time.time())
+        )
+        return bool(rows)
+
+    def set(self, key: str, concept: str, value: dict):
+        """Store value in memory now and queue the disk write."""
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        self._write(
+            lambda db: db.execute(
+                "INSERT OR REPLACE INTO visualizations (key, concept, value, expires_at) VALUES (?, ?, ?, ?)",
+                (key, normalize_concept(concept), orjson.dumps(value), expires_at),
+            )
+        )
+
+    def record_request(self, concept: str):
+        """Count a request for the concept in the access log."""
+        self._requested[normalize_concept(concept)] += 1
+        self._maybe_flush()
+
+    def record_transition(self, source: str, target: str):
+        """Count a user asking for `target` right after `source`."""
+        source, target = normalize_concept(source), normalize_concept(target)
+        if source and target and source != target:
+            self._transitions[source, target] += 1
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (
+            len(self._requested) + len(self._transitions) >= VIZ_ACCESS_LOG_FLUSH_EVERY
+            or time.monotonic() - self._flushed_at >= VIZ_ACCESS_LOG_FLUSH_SECONDS
+        ):
+            self.flush_requests()
+
+    def flush_requests(self):
+        """Queue the buffered request and transition counts for the access log."""
+        self._flushed_at = time.monotonic()
+        if self._transitions:
+            transitions, self._transitions = self._transitions, Counter()
+            self._write(
+                lambda db: db.executemany(
+                    """
+                    INSERT INTO concept_transitions (source, target, requests) VALUES (?, ?, ?)
+                    ON CONFLICT (source, target) DO UPDATE SET requests = requests + excluded.requests
+                    """,
+                    [(source, target, count) for (source, target), count in transitions.items()],
+                )
+            )
+        if not self._requested:
+            return
+        now = time.time()
+        pending, self._requested = self._requested, Counter()
+        self._write(
+            lambda db: db.executemany(
+                """
+                INSERT INTO concept_requests (concept, requests, last_requested) VALUES (?, ?, ?)
+                ON CONFLICT (concept) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    last_requested = excluded.last_requested
+                """,
+                [(concept, count, now) for concept, count in pending.items()],
+            )
+        )
+
+    async def _written_so_far(self):
+        """Wait until every write queued so far has reached the database."""
+        if self._writer is not None:
+            await asyncio.wrap_future(self._writer.submit(lambda: None))
+
+    async def top_concepts(self, limit: int) -> List[Tuple[str, int]]:
+        """Return the most-requested concepts and their request counts."""
+        self.flush_requests()
+        await self._written_so_far()
+        return await self._read(
+            "SELECT concept, requests FROM concept_requests ORDER BY requests DESC LIMIT ?", (limit,)
+        )
+
+    async def next_concepts(self, concept: str, limit: int) -> List[Tuple[str, int]]:
+        """Return the concepts most often requested right after this one, with their counts."""
+        return await self._read(
+            "SELECT target, requests FROM concept_transitions WHERE source = ? "
+            "ORDER BY requests DESC LIMIT ?",
+            (normalize_concept(concept), limit),
+        )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        """Write what is still queued, then close every connection."""
+        self.flush_requests()
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        for db in self._reader_dbs:
+            db.close()
+        self._reader_dbs = []
+        self._readers = threading.local()
+
+
+visualization_cache = VisualizationCache(
+    VIZ_CACHE_PATH, VIZ_CACHE_MAX_ENTRIES, VIZ_CACHE_TTL_SECONDS
+)
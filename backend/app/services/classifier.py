@@ -0,0 +1,116 @@
+import json
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Local classifier configuration
+CLASSIFIER_DATA_PATH = os.getenv(
+    "CLASSIFIER_DATA_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "data", "labelled_concepts.json"),
+)
+CLASSIFIER_CONFIDENCE_THRESHOLD = float(
+    os.getenv("CLASSIFIER_CONFIDENCE_THRESHOLD", "0.55")
+)
+CLASSIFIER_HASH_DIM = 2**14
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _features(text: str) -> List[str]:
+    """Word unigrams, word bigrams and padded character trigrams of the text."""
+    words = _TOKEN_RE.findall(text.lower())
+    features = [f"w:{word}" for word in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return features
+
+
+def _bucket(feature: str) -> int:
+    # crc32 rather than hash() so buckets are stable across processes
+    return zlib.crc32(feature.encode("utf-8")) % CLASSIFIER_HASH_DIM
+
+
+class ConceptClassifier:
+    """Hashed n-gram TF-IDF classifier trained on a labelled concept list.
+
+    Each concept is scored against every labelled example by cosine similarity;
+    a category's score is its best-matching example. The confidence is the top
+    score discounted by how close the runner-up category came, so an ambiguous
+    concept falls back to the LLM even when it looks familiar.
+    """
+
+    def __init__(self, labelled: Dict[str, List[str]]):
+        self.categories = list(labelled)
+        texts = [text for category in self.categories for text in labelled[category]]
+        # Examples are grouped by category, so each category is a contiguous slice
+        sizes = [len(labelled[category]) for category in self.categories]
+        self._offsets = np.cumsum([0] + sizes[:-1])
+
+        counts = np.stack([self._counts(text) for text in texts])
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self._idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(
+            np.float32
+        )
+        self._examples = self._normalize(counts * self._idf)
+
+    @staticmethod
+    def _sparse_counts(text: str) -> Tuple[np.ndarray, np.ndarray]:
+        buckets = np.fromiter(
+            (_bucket(feature) for feature in _features(text)), dtype=np.int64
+        )
+        return np.unique(buckets, return_counts=True)
+
+    @classmethod
+    def _counts(cls, text: str) -> np.ndarray:
+        vector = np.zeros(CLASSIFIER_HASH_DIM, dtype=np.float32)
+        buckets, counts = cls._sparse_counts(text)
+        vector[buckets] = counts
+        return vector
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def predict(self, concept: str) -> Tuple[str, float]:
+        """Return the most likely category and a confidence in [0, 1]."""
+        # Only the concept's own buckets contribute, so score against those columns alone
+        buckets, counts = self._sparse_counts(concept)
+        if buckets.size == 0:
+            return self.categories[0], 0.0
+        weights = self._normalize(counts * self._idf[buckets])
+        similarities = self._examples[:, buckets] @ weights
+
+        scores = np.maximum.reduceat(similarities, self._offsets)
+        second, best = np.argsort(scores)[-2:]
+        if scores[best] <= 0:
+            return self.categories[best], 0.0
+
+        margin = 1 - scores[second] / scores[best]
+        confidence = float(scores[best] * (0.5 + 0.5 * margin))
+        return self.categories[best], confidence
+
+
+_classifier: Optional[ConceptClassifier] = None
+
+
+def get_classifier() -> ConceptClassifier:
+    """Return the shared classifier, training it from the bundled data on first use."""
+    global _classifier
+    if _classifier is None:
+        with open(CLASSIFIER_DATA_PATH, encoding="utf-8") as f:
+            _classifier = ConceptClassifier(json.load(f))
+    return _classifier
+
+
+def classify_locally(concept: str) -> Tuple[Optional[str], float]:
+    """Classify without the LLM; the category is None below the confidence threshold."""
+    category, confidence = get_classifier().predict(concept)
+    if confidence < CLASSIFIER_CONFIDENCE_THRESHOLD:
+        return None, confidence
+    return category, confidence
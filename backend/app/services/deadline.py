@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from app.services.errors import DeadlineExceededError
+
+T = TypeVar("T")
+
+# End-to-end budget for a request that doesn't set its own
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+# Share of the remaining budget the LLM classification step may use, leaving the rest for generation
+CLASSIFY_DEADLINE_SHARE = float(os.getenv("CLASSIFY_DEADLINE_SHARE", "0.25"))
+
+# Absolute time.monotonic() deadline of the current request. Tasks copy the
+# context they were created in, so work spawned for a request inherits it.
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+# Set inside work that several requests share: returns that work's deadline when asked
+_shared_source: ContextVar[Optional[Callable[[], Optional[float]]]] = ContextVar(
+    "shared_deadline_source", default=None
+)
+
+
+@contextmanager
+def deadline_after(seconds: Optional[float]):
+    """Set the deadline for everything run inside the block; an outer, earlier deadline still wins."""
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = current_deadline()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def shared_deadline(source: Callable[[], Optional[float]]):
+    """Deadline for work that several requests wait on, such as a coalesced generation.
+
+    Work started inside the block is bounded by whatever `source` returns when
+    a stage starts, e.g. the latest deadline among its current waiters, rather
+    than by the deadline of the request that happened to start it.
+    """
+    token = _deadline.set(None)
+    source_token = _shared_source.set(source)
+    try:
+        yield
+    finally:
+        _shared_source.reset(source_token)
+        _deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    """Absolute time.monotonic() deadline in effect, or None when there is none."""
+    deadline = _deadline.get()
+    source = _shared_source.get()
+    shared = source() if source is not None else None
+    if deadline is None or shared is None:
+        return shared if deadline is None else deadline
+    return min(deadline, shared)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None when there is none."""
+    deadline = current_deadline()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(stage: str):
+    """Raise DeadlineExceededError if the deadline has already passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceededError(f"Deadline exceeded before {stage}")
+
+
+@asynccontextmanager
+async def deadline_stage(stage: str, share: float = 1.0):
+    """Bound a pipeline stage by its share of the remaining deadline.
+
+    Work still running when the stage's budget runs out is cancelled, which
+    closes the upstream HTTP request, and DeadlineExceededError is raised.
+    """
+    left = remaining()
+    if left is None:
+        yield
+        return
+    check(stage)
+    try:
+        async with asyncio.timeout(left * share):
+            yield
+    except TimeoutError as e:
+        raise DeadlineExceededError(f"Deadline exceeded during {stage}") from e
+
+
+async def wait_within_deadline(awaitable: Awaitable[T], stage: str) -> T:
+    """Await something, giving up with DeadlineExceededError when the deadline passes."""
+    async with deadline_stage(stage):
+        return await awaitable
+
+
+async def iter_within_deadline(iterator: AsyncIterator[T], stage: str) -> AsyncIterator[T]:
+    """Iterate, bounding each wait for the next item by the remaining deadline.
+
+    A timeout cannot be held open across a yield, so a streamed stage is
+    bounded one step at a time instead.
+    """
+    try:
+        while True:
+            async with deadline_stage(stage):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield item
+    finally:
+        await iterator.aclose()
@@ -0,0 +1,192 @@
+import gzip
+import hashlib
+import os
+from typing import Optional
+
+import orjson
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # Optional: without it responses are gzipped
+    brotli = None
+
+# Bodies smaller than this are sent as they are; compressing them saves next to nothing
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "512"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Brotli's top qualities are far too slow to run per response
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson")
+
+# Element fields in the order the compact encoding lists them
+ELEMENT_FIELDS = ("label", "type", "position", "description")
+
+
+def encode_visualization(result: dict, compact: bool = False) -> bytes:
+    """Serialize a plan as the /visualize response body.
+
+    The compact form drops unset plan fields and sends the elements as
+    {"fields": [...], "rows": [[...], ...]}, so each element's keys are not
+    repeated; a client rebuilds them by zipping fields with each row.
+    """
+    visualization = result["visualization"]
+    if compact:
+        visualization = {
+            field: value
+            for field, value in visualization.items()
+            if field != "elements" and value is not None
+        }
+        visualization["elements"] = {
+            "fields": ELEMENT_FIELDS,
+            "rows": [
+                [element.get(field) for field in ELEMENT_FIELDS]
+                for element in result["visualization"]["elements"]
+            ],
+        }
+    return orjson.dumps({"category": result["category"], "visualization": visualization})
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag for a response body: a hash of its bytes."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _opaque_tag(tag: str) -> str:
+    # The compression middleware tags compressed bodies as "<hash>-<encoding>",
+    # so a client revalidating a compressed copy still matches the plain body
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    for encoding in ("br", "gzip"):
+        if tag.endswith("-" + encoding):
+            return tag[: -len(encoding) - 1]
+    return tag
+
+
+def matching_etag(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    """The tag in an If-None-Match header that names `etag`, if any.
+
+    Uses the weak comparison RFC 9110 asks for. The client's own tag is
+    returned so a 304 repeats the ETag of the copy the client holds, which
+    may be the compressed variant.
+    """
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return etag
+    wanted = _opaque_tag(etag)
+    for tag in if_none_match.split(","):
+        if _opaque_tag(tag) == wanted:
+            return tag.strip()
+    return None
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, preferring br when it is available."""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip())
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class EgressStats:
+    """Counts of what the API sent, and what conditional requests and compression saved."""
+
+    def __init__(self):
+        self.not_modified = 0
+        self.compressed = 0
+        self.bytes_before_compression = 0
+        self.bytes_after_compression = 0
+
+    def stats(self) -> dict:
+        before = self.bytes_before_compression
+        return {
+            "not_modified": self.not_modified,
+            "compressed": self.compressed,
+            "bytes_before_compression": before,
+            "bytes_after_compression": self.bytes_after_compression,
+            "compression_ratio": self.bytes_after_compression / before if before else 0.0,
+        }
+
+
+egress_stats = EgressStats()
+
+
+class CompressionMiddleware:
+    """Compress complete response bodies with brotli or gzip, as the client accepts.
+
+    Only responses whose whole body arrives in one message are compressed.
+    Streamed responses (SSE, NDJSON batches) pass through untouched, so a
+    compressor never holds back events the client is waiting for.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+
+        async def send_compressed(message: Message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # Hold the headers back until the first body message shows what we have
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+
+            response_start, start = start, None
+            headers = MutableHeaders(scope=response_start)
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+            ):
+                await send(response_start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            egress_stats.compressed += 1
+            egress_stats.bytes_before_compression += len(body)
+            egress_stats.bytes_after_compression += len(compressed)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and etag.endswith('"'):
+                # A strong ETag names exact bytes, so the compressed body needs its own
+                headers["ETag"] = etag[:-1] + "-" + encoding + '"'
+            await send(response_start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
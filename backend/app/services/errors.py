@@ -0,0 +1,46 @@
+from typing import Optional
+
+
+class GeminiError(Exception):
+    """Base class for failures talking to the Gemini API."""
+
+    # Seconds the caller should wait before trying again, when known
+    retry_after: Optional[float] = None
+
+
+class GeminiTransportError(GeminiError):
+    """The request never got a response (connect failure, timeout, dropped connection)."""
+
+
+class GeminiStatusError(GeminiError):
+    """Gemini answered with a non-200 status."""
+
+    def __init__(self, status_code: int, body: str, retry_after: Optional[float] = None):
+        super().__init__(f"API call failed with status {status_code}")
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+
+class GeminiRateLimitError(GeminiStatusError):
+    """Gemini rejected the request for exceeding quota (429)."""
+
+
+class GeminiServerError(GeminiStatusError):
+    """Gemini failed on its side (5xx)."""
+
+
+class GeminiResponseError(GeminiError):
+    """Gemini returned 200 but the body held no usable candidate text."""
+
+
+class CircuitOpenError(GeminiError):
+    """Gemini calls are being refused locally because upstream looks degraded."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Gemini is temporarily unavailable")
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(GeminiError):
+    """The request's deadline passed before Gemini answered; the upstream call was cancelled."""
@@ -1,241 +1,256 @@
+import asyncio
+import logging
 import os
-import json
-import requests
-from dotenv import load_dotenv
+import time
+from typing import List, Optional, Tuple
 
-# Load environment variables from .env file
-load_dotenv()
+import httpx
+import orjson
+from pydantic import ValidationError
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
-# Google Gemini API configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+from app.services.classifier import classify_locally, get_classifier
+from app.services.http_client import get_http_client
+from app.services.deadline import CLASSIFY_DEADLINE_SHARE, deadline_stage, iter_within_deadline
+from app.services.errors import GeminiResponseError, GeminiTransportError
+from app.services.hedging import gemini_hedger
+from app.models.concept import VisualizationPlan
+from app.services.json_stream import IncrementalPlanParser
+from app.services.llm_json import loads_object, parse_visualization
+from app.services.prompts import (
+    CATEGORY_PROMPTS,
+    CLASSIFY_BATCH_SIZE,
+    CLASSIFY_TOKENS_PER_CONCEPT,
+    PROMPT_VERSION,
+    PROMPTS,
+    Prompt,
+    budget_fingerprint,
+    visualization_prompt,
+)
+from app.services.metrics import (
+    CLASSIFY_SECONDS,
+    GENERATION_SECONDS,
+    JSON_PARSE_SECONDS,
+    record_usage,
+    record_visualization,
+    span,
+    timed,
+)
+from app.services.resilience import send_with_retries
 
+logger = logging.getLogger(__name__)
 
 
-def call_gemini_api(messages, temperature=0.5, max_tokens=1024):
-    """Call Google Gemini API with the given messages."""
-    # Convert messages to Gemini format
-    # Combine system and user messages into a single text prompt
-    combined_text = ""
-    for message in messages:
-        if message["role"] == "system":
-            combined_text += f"{message['content']}\n\n"
-        elif message["role"] == "user":
-            combined_text += f"{message['content']}\n\n"
+class GeminiSettings(BaseSettings):
+    """Google Gemini endpoint and credentials, from GEMINI_* environment variables or .env.
 
+    These three fields are the only settings read from .env; every other knob
+    is a module constant read from the process environment.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="GEMINI_", env_file=".env", extra="ignore")
+
+    api_key: str = ""
+    api_base: str = "https://generativelanguage.googleapis.com/v1beta"
+    model: str = "gemini-2.0-flash"
+
+    @property
+    def generate_url(self) -> str:
+        return f"{self.api_base.rstrip('/')}/models/{self.model}:generateContent"
+
+    @property
+    def stream_url(self) -> str:
+        return f"{self.api_base.rstrip('/')}/models/{self.model}:streamGenerateContent?alt=sse"
+
+
+_settings: Optional[GeminiSettings] = None
+
+
+def get_gemini_settings() -> GeminiSettings:
+    """Return the active Gemini settings, reading the environment on first use."""
+    global _settings
+    if _settings is None:
+        _settings = GeminiSettings()
+    return _settings
+
+
+def configure_gemini(settings: Optional[GeminiSettings] = None, **overrides) -> GeminiSettings:
+    """Replace the active Gemini settings, e.g. to point the app at a mock server.
+
+    Keyword overrides are applied on top of `settings`, or of the environment
+    when no settings object is given.
+    """
+    global _settings
+    base = settings or GeminiSettings()
+    _settings = base.model_copy(update=overrides) if overrides else base
+    return _settings
+
+
+# Generation settings for the visualization plan call; output budgets live in prompts
+VISUALIZATION_TEMPERATURE = 0.3
+
+# "two_step" classifies then generates; "combined" does both in one structured-output call
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "two_step")
+
+
+def cache_namespace(mode: str = PIPELINE_MODE) -> str:
+    """Identify everything besides the concept that shapes a generated plan."""
+    return f"{get_gemini_settings().model}:p{PROMPT_VERSION}:t{VISUALIZATION_TEMPERATURE}:m{budget_fingerprint()}:{mode}"
+
+
+def _build_request(prompt: Prompt, temperature, max_tokens, response_schema):
+    """Build the Gemini request headers and payload for a rendered prompt."""
     payload = {
-        "contents": [{"parts": [{"text": combined_text}]}],
+        # The template's fixed instructions go first as systemInstruction, a
+        # prefix shared by every call with the template that Gemini can cache
+        "systemInstruction": {"parts": [{"text": prompt.system}]},
+        "contents": [{"role": "user", "parts": [{"text": prompt.user}]}],
         "generationConfig": {
             "temperature": temperature,
-            "maxOutputTokens": max_tokens,
+            "maxOutputTokens": max_tokens or prompt.template.max_output_tokens,
         },
     }
+    if response_schema is not None:
+        # Constrain decoding to JSON matching the schema
+        payload["generationConfig"]["responseMimeType"] = "application/json"
+        payload["generationConfig"]["responseSchema"] = response_schema
+
+    # Send the key as a header so it never shows up in logged request URLs
+    headers = {"Content-Type": "application/json", "x-goog-api-key": get_gemini_settings().api_key}
+    return headers, payload
 
-    headers = {"Content-Type": "application/json"}
 
+async def call_gemini_api(prompt: Prompt, temperature=0.5, max_tokens=None, response_schema=None):
+    """Call Google Gemini API with a rendered prompt.
+
+    max_tokens defaults to the template's output budget.
+
+    Raises a GeminiError subclass when the call fails after retries or the
+    response carries no text.
+    """
+    text, _ = await _call_gemini(prompt, temperature, max_tokens, response_schema)
+    return text
+
+
+async def _call_gemini(
+    prompt: Prompt, temperature=0.5, max_tokens=None, response_schema=None
+) -> Tuple[str, Optional[str]]:
+    """call_gemini_api, also returning the candidate's finishReason (e.g. "MAX_TOKENS")."""
+    headers, payload = _build_request(prompt, temperature, max_tokens, response_schema)
+    request = get_http_client().build_request(
+        "POST", get_gemini_settings().generate_url, headers=headers, json=payload
+    )
+    response = await send_with_retries(request)
+
+    response_data = orjson.loads(response.content)
+    usage = response_data.get("usageMetadata", {})
+    record_usage(usage)
+    prompt.template.observe(usage)
+    # Extract text from Gemini response format
+    if "candidates" in response_data and len(response_data["candidates"]) > 0:
+        candidate = response_data["candidates"][0]
+        if "content" in candidate and "parts" in candidate["content"]:
+            text_response = candidate["content"]["parts"][0]["text"]
+            logger.debug("gemini_response chars=%d preview=%r", len(text_response), text_response[:200])
+            return text_response, candidate.get("finishReason")
+    raise GeminiResponseError("Unexpected response format")
+
+
+async def stream_gemini_api(prompt: Prompt, temperature=0.5, max_tokens=None, response_schema=None):
+    """Stream text chunks from Gemini as they are generated.
+
+    Only opening the stream is retried; once text has been yielded a dropped
+    connection raises GeminiTransportError.
+    """
+    headers, payload = _build_request(prompt, temperature, max_tokens, response_schema)
+    request = get_http_client().build_request(
+        "POST", get_gemini_settings().stream_url, headers=headers, json=payload
+    )
+    response = await send_with_retries(request, stream=True)
+
+    usage = {}
     try:
-        response = requests.post(
-            f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-            headers=headers,
-            json=payload,
-            timeout=30,
-        )
+        # Each server-sent event carries one partial GenerateContentResponse
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = orjson.loads(line[len("data:"):])
+            # Every chunk repeats the running usage; the last one has the totals
+            usage = chunk.get("usageMetadata", usage)
+            for candidate in chunk.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+    except httpx.HTTPError as e:
+        logger.warning("gemini_stream_interrupted error=%r", str(e))
+        raise GeminiTransportError(f"Stream interrupted - {str(e)}") from e
+    finally:
+        await response.aclose()
+        record_usage(usage)
+        prompt.template.observe(usage)
+
+
+
+_CATEGORY_SCHEMA = {"type": "STRING", "enum": list(CATEGORY_PROMPTS.keys())}
+
+_ELEMENT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "label": {"type": "STRING"},
+        "type": {"type": "STRING"},
+        "position": {"type": "STRING"},
+        "description": {"type": "STRING"},
+    },
+    "required": ["label", "type", "position", "description"],
+    "propertyOrdering": ["label", "type", "position", "description"],
+}
 
-        if response.status_code == 200:
-            response_data = response.json()
-            # Extract text from Gemini response format
-            if "candidates" in response_data and len(response_data["candidates"]) > 0:
-                candidate = response_data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    text_response = candidate["content"]["parts"][0]["text"]
-                    print(f"Gemini API Response: {text_response[:200]}...")
-                    return text_response
-            return "Error: Unexpected response format"
-        else:
-            print(f"API Error: {response.status_code} - {response.text}")
-            return f"Error: API call failed with status {response.status_code}: {response.text}"
-    except requests.exceptions.RequestException as e:
-        print(f"Request Exception: {e}")
-        return f"Error: Request failed - {str(e)}"
-
-
-CATEGORY_PROMPTS = {
-    # The Computer Science and Math prompts are already in the correct format from our last exchange.
-    # Here are all the others, updated to match.
-    "Computer Science & Technology": """
-You are a world-class technical educator. Your job is to output a JSON object describing how to visually teach the following computer science concept.
-The response must be a JSON object that strictly adheres to the following structure:
-- title: A short title for the concept.
-- layout: A brief description of the overall visual arrangement (e.g., "A horizontal array of boxes representing memory slots...").
-- interaction: A description of the primary user interaction (e.g., "User clicks a 'Next Step' button to see the pointers move and values swap.").
-- elements: A list of visual element objects. Each object must have:
-  - label: The name or text on the element (e.g., "Array", "Pointer").
-  - type: The kind of element (e.g., "box", "arrow", "text").
-  - position: A descriptive position (e.g., "top-center", "dynamic").
-  - description: A short explanation of the element's role.
-
-Return only valid JSON. No markdown, no extra explanation.
-
-Concept: "{concept}"
-""",
-    "Mathematics & Logic": """
-You are a top-tier math educator. Your job is to output a JSON object describing how to visually teach the following math or logic concept.
-The response must be a JSON object that strictly adheres to the following structure:
-- title: Short name of the concept.
-- layout: Description of the visual setup (e.g., "A Cartesian plane with X and Y axes...").
-- interaction: How the user interacts with the visual (e.g., "User can drag a point on the line to see the equation update.").
-- elements: A list of visual element objects. Each object must have:
-  - label: The name of the element (e.g., "X-axis", "Parabola").
-  - type: The kind of element (e.g., "graph", "equation-text", "point").
-  - position: Its location (e.g., "bottom", "top-right").
-  - description: Its purpose in the visualization.
-
-Return only valid JSON. No markdown, no extra explanation.
-
-Concept: "{concept}"
-""",
-    "Physical Sciences": """
-You are a physics educator. Output a JSON object to visually explain a scientific principle, adhering to this structure:
-- title: Name of the principle.
-- layout: A description of the scene (e.g., "A central sun with planets orbiting in ellipses.").
-- interaction: A description of how the visual responds to user action or animates (e.g., "Animation plays showing the conservation of momentum as two objects collide.").
-- elements: A list of visual objects, each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Biological & Health Sciences": """
-You are a biology educator. Output a JSON object to visually explain a biological concept, adhering to this structure:
-- title: A clear title for the concept.
-- layout: A description of the biological diagram (e.g., "A cross-section of a plant cell with major organelles visible.").
-- interaction: A description of the dynamic aspect of the visual (e.g., "User clicks on an organelle to see its function displayed in a side panel.").
-- elements: A list of visual objects (e.g., 'Mitochondria', 'Cell Wall'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Social Sciences": """
-You are a sociologist. Output a JSON object to visually explain a social concept, adhering to this structure:
-- title: A title for the social concept.
-- layout: A description of the visual arrangement (e.g., "A network graph of nodes representing people and lines representing relationships.").
-- interaction: A description of how it works (e.g., "User can toggle different social filters to see how connections change.").
-- elements: A list of visual objects (e.g., 'Node', 'Connection', 'Group'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "History & Civilization": """
-You are a historian. Output a JSON object for a visual historical narrative, adhering to this structure:
-- title: The name of the historical event or topic.
-- layout: A description of the visual setup (e.g., "A vertical timeline with key dates, alongside an interactive map.").
-- interaction: A description of how the user explores (e.g., "Scrolling the timeline highlights corresponding locations on the map.").
-- elements: A list of visual objects (e.g., 'Event Marker', 'Map Region'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Philosophy & Ethics": """
-You are a philosopher. Output a JSON object to visualize a philosophical concept, adhering to this structure:
-- title: The name of the concept.
-- layout: A description of the abstract visual metaphor (e.g., "A set of balancing scales representing utilitarian calculus.").
-- interaction: A description of the interactive component (e.g., "User drags 'weights' of happiness onto the scales to see the ethical outcome.").
-- elements: A list of symbolic objects, each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Economics & Business": """
-You are an economist. Output a JSON object for a visual economic model, adhering to this structure:
-- title: The name of the concept.
-- layout: A description of the visual arrangement (e.g., "A standard supply and demand graph with price on the Y-axis and quantity on the X-axis.").
-- interaction: A description of how it's used (e.g., "User drags the demand curve to the right to see the new equilibrium point.").
-- elements: A list of visual objects (e.g., 'Supply Curve', 'Demand Curve'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Politics & Law": """
-You are a political scientist. Output a JSON object to visually explain a political concept, adhering to this structure:
-- title: The name of the concept.
-- layout: A description of the visual structure (e.g., "A flowchart showing the three branches of government.").
-- interaction: A description of how it works (e.g., "User clicks on a branch to expand it and see its powers and responsibilities.").
-- elements: A list of visual objects (e.g., 'Legislative Branch', 'Executive Branch'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Art & Design": """
-You are a design instructor. Output a JSON object to visually break down a design concept, adhering to this structure:
-- title: The name of the concept or principle.
-- layout: A description of the visual explanation (e.g., "A sample photograph with an overlay of the rule-of-thirds grid.").
-- interaction: A description of the interactive element (e.g., "User can drag the grid lines to see how it changes the composition's balance.").
-- elements: A list of visual objects (e.g., 'Grid Line', 'Focal Point'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Literature & Language": """
-You are a linguistics expert. Output a JSON object to visually represent a literary or linguistic idea, adhering to this structure:
-- title: The name of the concept.
-- layout: A description of the visual diagram (e.g., "A narrative arc plotted on a graph of tension versus time.").
-- interaction: A description of how it's explored (e.g., "User hovers over key points on the arc to read plot summaries for that stage.").
-- elements: A list of visual objects (e.g., 'Exposition', 'Climax', 'Resolution'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Media & Communication": """
-You are a communication theorist. Output a JSON object to visually model a media concept, adhering to this structure:
-- title: The name of the model or concept.
-- layout: A description of the diagram (e.g., "A diagram showing the Shannon-Weaver model of communication with all its parts.").
-- interaction: A description of the animation (e.g., "An animated icon travels from the sender to the receiver, transforming as it passes through the 'noise' element.").
-- elements: A list of visual objects (e.g., 'Sender', 'Encoder', 'Channel'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Education & Learning": """
-You are a pedagogy specialist. Output a JSON object to visually explain a learning concept, adhering to this structure:
-- title: The name of the educational theory or method.
-- layout: A description of the visual representation (e.g., "Bloom's Taxonomy shown as a multi-layered pyramid.").
-- interaction: A description of how it works (e.g., "User clicks on each level of the pyramid to see example learning activities and verbs.").
-- elements: A list of visual objects for each level, each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Environment & Sustainability": """
-You are an environmental scientist. Output a JSON object to visually explain an environmental concept, adhering to this structure:
-- title: The name of the concept.
-- layout: A description of the system diagram (e.g., "A flowchart of the carbon cycle showing atmospheric and terrestrial reservoirs.").
-- interaction: A description of the animation (e.g., "Carbon animates from the atmosphere to plants and back through respiration and decomposition.").
-- elements: A list of visual objects (e.g., 'Atmosphere', 'Plants', 'Fossil Fuels'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
-    "Lifestyle & Personal Development": """
-You are a personal development coach. Output a JSON object to create an interactive tool, adhering to this structure:
-- title: The name of the concept or tool.
-- layout: A description of the visual tool (e.g., "A circular 'Wheel of Life' divided into 8 sections representing different life areas.").
-- interaction: A description of how the user engages (e.g., "User can click and drag each section's edge to rate their satisfaction from 1 to 10.").
-- elements: A list of visual objects for each life area (e.g., 'Career', 'Health'), each with a 'label', 'type', 'position', and 'description'.
-Return only valid JSON. No markdown, no extra explanation.
-Concept: "{concept}"
-""",
+VISUALIZATION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "layout": {"type": "STRING"},
+        "interaction": {"type": "STRING"},
+        "elements": {"type": "ARRAY", "items": _ELEMENT_SCHEMA},
+    },
+    "required": ["title", "layout", "interaction", "elements"],
+    "propertyOrdering": ["title", "layout", "interaction", "elements"],
 }
 
+COMBINED_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "category": _CATEGORY_SCHEMA,
+        "visualization": VISUALIZATION_SCHEMA,
+    },
+    "required": ["category", "visualization"],
+    "propertyOrdering": ["category", "visualization"],
+}
 
-async def classify_concept(concept: str) -> str:
-    """Ask Gemini to classify the concept into one of the defined categories."""
-    categories = list(CATEGORY_PROMPTS.keys())
 
-    # Use a system message to set the context and a user message for the specific task
-    prompt_messages = [
-        {
-            "role": "system",
-            "content": "You are an intelligent classifier. Your task is to select the most appropriate category for a given concept from a predefined list. Respond with ONLY the exact category name.",
-        },
-        {
-            "role": "user",
-            "content": f"""Classify this concept: "{concept}"
+async def classify_concept(concept: str) -> str:
+    """Classify the concept locally, asking Gemini only when the local model is unsure."""
+    with timed(CLASSIFY_SECONDS, "local"):
+        local_category, confidence = classify_locally(concept)
+    if local_category is not None:
+        logger.info(
+            "classified concept=%r category=%r source=local confidence=%.2f",
+            concept, local_category, confidence,
+        )
+        return local_category
+    logger.info("local_classifier_unsure concept=%r confidence=%.2f", concept, confidence)
 
-Choose the most appropriate category from these options:
-{chr(10).join(categories)}
+    with span("classify_llm", concept=concept), timed(CLASSIFY_SECONDS, "llm"):
+        async with deadline_stage("classification", CLASSIFY_DEADLINE_SHARE):
+            category = await call_gemini_api(PROMPTS["classify"].render(concept), temperature=0)
+    category = _match_category(category)
+    logger.info("classified concept=%r category=%r source=llm", concept, category)
+    return category
 
-Respond with ONLY the exact category name from the list above.""",
-        },
-    ]
 
-    category = call_gemini_api(prompt_messages, temperature=0, max_tokens=50)
+def _match_category(category: str) -> str:
+    """Map a model-produced category name onto one of the CATEGORY_PROMPTS keys."""
+    categories = list(CATEGORY_PROMPTS.keys())
 
     # Clean up the response and fallback to default if needed
     category = category.strip()
@@ -247,101 +262,245 @@ Respond with ONLY the exact category name from the list above.""",
 
     # If no exact match, try partial match
     for cat in categories:
-        if cat.lower() in category.lower() or category.lower() in cat.lower():
+        if category and (cat.lower() in category.lower() or category.lower() in cat.lower()):
             return cat
 
-    print(
-        f"Warning: Could not match category '{category}' to any predefined category. Using default."
-    )
+    logger.warning("unmatched_category answer=%r default='Education & Learning'", category)
     return "Education & Learning"
 
 
-async def generate_concept_visualization(concept: str):
-    """Generate structured visualization JSON using the categorized prompt."""
-    print(f"Step 1: Classifying concept '{concept}'...")
-    category = await classify_concept(concept)
-    print(f"Step 2: Classified as '{category}'. Generating visualization plan...")
-
-    # Retrieve the specific prompt for the determined category and format it with the concept
-    prompt_template = CATEGORY_PROMPTS.get(
-        category, CATEGORY_PROMPTS["Education & Learning"]
+async def _classify_batch(concepts: List[str]) -> List[str]:
+    numbered = "\n".join(f"{n}. {concept}" for n, concept in enumerate(concepts, 1))
+    template = PROMPTS["classify_batch"]
+    response_str = await call_gemini_api(
+        template.render(numbered),
+        temperature=0,
+        max_tokens=CLASSIFY_TOKENS_PER_CONCEPT * len(concepts) + template.max_output_tokens,
+        response_schema={"type": "ARRAY", "items": _CATEGORY_SCHEMA},
     )
-    final_prompt = prompt_template.format(concept=concept)
-
-    # Use a system message to reinforce the JSON output requirement
-    prompt_messages = [
-        {
-            "role": "system",
-            "content": "You are a helpful assistant that outputs structured JSON data for educational visualizations. You must return ONLY valid JSON without any markdown formatting, explanations, or extra text.",
-        },
-        {
-            "role": "user",
-            "content": final_prompt
-            + "\n\nIMPORTANT: Your response must be valid JSON only. Do not include any markdown code blocks, explanations, or other text.",
-        },
+    try:
+        answers = orjson.loads(response_str)
+    except orjson.JSONDecodeError:
+        answers = []
+    if not isinstance(answers, list):
+        answers = []
+    answers += [""] * (len(concepts) - len(answers))
+    return [_match_category(str(answer)) for answer in answers[: len(concepts)]]
+
+
+async def classify_concepts(concepts: List[str]) -> List[str]:
+    """Classify many concepts, sending what the local model is unsure about to Gemini in batches.
+
+    Each batch holds at most CLASSIFY_BATCH_SIZE concepts, so its output
+    budget stays under the model's maxOutputTokens limit.
+    """
+    local = [classify_locally(concept) for concept in concepts]
+    categories = [category for category, _ in local]
+    unsure = [i for i, category in enumerate(categories) if category is None]
+    if not unsure:
+        return categories
+    logger.info("local_classifier_unsure batch_size=%d unsure=%d", len(concepts), len(unsure))
+
+    chunks = [
+        unsure[start : start + CLASSIFY_BATCH_SIZE]
+        for start in range(0, len(unsure), CLASSIFY_BATCH_SIZE)
     ]
+    async with deadline_stage("classification", CLASSIFY_DEADLINE_SHARE):
+        answers = await asyncio.gather(
+            *(_classify_batch([concepts[i] for i in chunk]) for chunk in chunks)
+        )
+    for chunk, chunk_answers in zip(chunks, answers):
+        for i, category in zip(chunk, chunk_answers):
+            categories[i] = category
+    return categories
+
+
+async def generate_concept_visualization(
+    concept: str, mode: Optional[str] = None, category: Optional[str] = None
+):
+    """Generate structured visualization JSON, in one or two Gemini calls depending on mode.
+
+    In two-step mode a category that is already known (e.g. from classify_concepts) skips step 1.
+    """
+    mode = mode or PIPELINE_MODE
+    with span("generate_visualization", concept=concept, mode=mode), timed(
+        GENERATION_SECONDS, mode
+    ):
+        if mode == "combined":
+            result = await _generate_combined(concept)
+        else:
+            result = await _generate_two_step(concept, category)
+    record_visualization(result)
+    return result
+
+
+async def _generate_two_step(concept: str, category: Optional[str]):
+    """Classify (unless the category is already known), then generate with the category prompt."""
+    if category is None:
+        category = await classify_concept(concept)
+
+    prompt = visualization_prompt(category).render(concept)
+    async with deadline_stage("generation"):
+        visualization_str, finish_reason = await gemini_hedger.run(
+            lambda: _call_gemini(
+                prompt,
+                temperature=VISUALIZATION_TEMPERATURE,
+                response_schema=VISUALIZATION_SCHEMA,
+            )
+        )
+
+    partial = False
+    with timed(JSON_PARSE_SECONDS):
+        plan = parse_visualization(visualization_str, allow_truncated=False)
+        if plan is None:
+            plan = parse_visualization(visualization_str)
+            partial = plan is not None
+    partial = _flag_partial(concept, plan is not None and (partial or finish_reason == "MAX_TOKENS"))
+    fallback = plan is None
+    if fallback:
+        logger.warning("unparseable_plan concept=%r preview=%r", concept, visualization_str[:500])
+        visualization_json = _fallback_visualization(concept)
+    else:
+        visualization_json = plan.model_dump()
+
+    return {
+        "concept": concept,
+        "category": category,
+        "visualization": visualization_json,
+        "fallback": fallback,
+        "partial": partial,
+        "mode": "two_step",
+    }
 
-    visualization_str = call_gemini_api(
-        prompt_messages, temperature=0.3, max_tokens=1024
-    )
 
-    print("Step 3: Visualization plan received. Parsing JSON...")
-    print(f"Raw response length: {len(visualization_str)}")
-
-    # Clean the response to extract JSON
-    cleaned_response = visualization_str.strip()
-
-    # Remove any markdown code block formatting if present
-    if cleaned_response.startswith("```"):
-        lines = cleaned_response.split("\n")
-        # Remove first line if it's ```json or ```
-        if lines[0].strip().startswith("```"):
-            lines = lines[1:]
-        # Remove last line if it's ```
-        if lines and lines[-1].strip() == "```":
-            lines = lines[:-1]
-        cleaned_response = "\n".join(lines)
-
-    # Try to find JSON content between curly braces
-    if not cleaned_response.strip().startswith("{"):
-        # Look for JSON object in the response
-        import re
-
-        json_match = re.search(r"\{.*\}", cleaned_response, re.DOTALL)
-        if json_match:
-            cleaned_response = json_match.group(0)
-
-    # Try to parse the string as JSON, with a fallback to return a default structure
+def _flag_partial(concept: str, partial: bool) -> bool:
+    if partial:
+        # Usable for this response, but a complete plan may come next time, so it isn't cached
+        logger.warning("truncated_plan concept=%r", concept)
+    return partial
+
+
+def is_cacheable(result: dict) -> bool:
+    """Whether a generated result may be cached: neither the placeholder nor a repaired truncated plan."""
+    return not result.get("fallback") and not result.get("partial")
+
+
+async def stream_concept_visualization(concept: str):
+    """Yield (event, data) pairs as the visualization plan is generated.
+
+    The category is emitted as soon as classification finishes, then each plan
+    field and each element as soon as the streamed JSON completes it. The last
+    event is "done" with the full result, shaped like generate_concept_visualization's.
+    """
+    started = time.perf_counter()
+    category = await classify_concept(concept)
+    yield "category", {"category": category}
+
+    parser = IncrementalPlanParser()
+    visualization_json = {}
     try:
-        visualization_json = json.loads(cleaned_response)
-        print("Successfully parsed JSON response")
-    except json.JSONDecodeError as e:
-        print(f"JSON Parse Error: {e}")
-        print(f"Attempted to parse: {cleaned_response[:500]}...")
-
-        # Return a fallback structure that matches the expected format
-        visualization_json = {
-            "title": concept.title(),
-            "layout": f"A visual representation of {concept}",
-            "interaction": f"Interactive elements to explore {concept}",
-            "elements": [
-                {
-                    "label": "Main Component",
-                    "type": "diagram",
-                    "position": "center",
-                    "description": f"Primary visual element explaining {concept}",
-                },
-                {
-                    "label": "Details Panel",
-                    "type": "text",
-                    "position": "side",
-                    "description": "Additional information and explanations",
-                },
-            ],
-        }
+        chunks = stream_gemini_api(
+            visualization_prompt(category).render(concept),
+            temperature=VISUALIZATION_TEMPERATURE,
+            response_schema=VISUALIZATION_SCHEMA,
+        )
+        async for chunk in iter_within_deadline(chunks, "generation"):
+            for field, value in parser.feed(chunk):
+                if field == "element":
+                    visualization_json.setdefault("elements", []).append(value)
+                else:
+                    visualization_json[field] = value
+                yield field, value
+    except orjson.JSONDecodeError as e:
+        logger.warning("stream_parse_error concept=%r error=%r", concept, str(e))
+
+    fallback = True
+    if parser.done:
+        try:
+            visualization_json = VisualizationPlan.model_validate(visualization_json).model_dump()
+            fallback = False
+        except ValidationError as e:
+            logger.warning("invalid_plan concept=%r errors=%d", concept, e.error_count())
+    if fallback:
+        logger.warning("unusable_streamed_plan concept=%r", concept)
+        visualization_json = _fallback_visualization(concept)
+
+    GENERATION_SECONDS.labels("stream").observe(time.perf_counter() - started)
+    result = {
+        "concept": concept,
+        "category": category,
+        "visualization": visualization_json,
+        "fallback": fallback,
+        "partial": False,
+        "mode": "two_step",
+    }
+    record_visualization(result)
+    yield "done", result
+
+
+async def _generate_combined(concept: str):
+    """Pick the category and write the plan in a single structured-output call."""
+    prompt = PROMPTS["combined"].render(concept)
+    async with deadline_stage("generation"):
+        response_str, finish_reason = await gemini_hedger.run(
+            lambda: _call_gemini(
+                prompt,
+                temperature=VISUALIZATION_TEMPERATURE,
+                response_schema=COMBINED_RESPONSE_SCHEMA,
+            )
+        )
+
+    plan = None
+    partial = False
+    with timed(JSON_PARSE_SECONDS):
+        response_json = loads_object(response_str, allow_truncated=False)
+        if response_json is None:
+            response_json = loads_object(response_str)
+            partial = True
+        if response_json is not None:
+            try:
+                plan = VisualizationPlan.model_validate(response_json.get("visualization"))
+            except ValidationError as e:
+                logger.warning("invalid_plan concept=%r errors=%d", concept, e.error_count())
+    if plan is not None:
+        category = _match_category(str(response_json.get("category", "")))
+        visualization_json = plan.model_dump()
+        fallback = False
+    else:
+        logger.warning("unparseable_plan concept=%r preview=%r", concept, response_str[:500])
+        # Don't spend another round-trip on the LLM classifier for a failed call
+        category, _ = get_classifier().predict(concept)
+        visualization_json = _fallback_visualization(concept)
+        fallback = True
 
     return {
         "concept": concept,
         "category": category,
         "visualization": visualization_json,
+        "fallback": fallback,
+        "partial": _flag_partial(concept, not fallback and (partial or finish_reason == "MAX_TOKENS")),
+        "mode": "combined",
+    }
+
+
+def _fallback_visualization(concept: str) -> dict:
+    """Placeholder plan that matches the expected format when the model output is unusable."""
+    return {
+        "title": concept.title(),
+        "layout": f"A visual representation of {concept}",
+        "interaction": f"Interactive elements to explore {concept}",
+        "elements": [
+            {
+                "label": "Main Component",
+                "type": "diagram",
+                "position": "center",
+                "description": f"Primary visual element explaining {concept}",
+            },
+            {
+                "label": "Details Panel",
+                "type": "text",
+                "position": "side",
+                "description": "Additional information and explanations",
+            },
+        ],
     }
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Hedged generation calls: a duplicate is sent when the first is slower than usual
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+# Latency percentile after which the duplicate goes out, over the last HEDGE_WINDOW calls
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+# No hedging until this many latencies have been observed, and never sooner than this
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+# At most this fraction of calls may be duplicated
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+
+
+class Hedger:
+    """Tail-latency hedging: race a second attempt against a slow first one.
+
+    If the first attempt has not finished after the configured percentile of
+    recent latencies, an identical second attempt is started and whichever
+    succeeds first wins; the other is cancelled. Every call earns `budget`
+    of a hedge token and every hedge spends a whole one, so duplicates stay
+    below that fraction of traffic even when upstream slows down as a whole.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        percentile: float,
+        window: int,
+        min_samples: int,
+        min_delay: float,
+        budget: float,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = budget
+        self._latencies = deque(maxlen=window)
+        # A small allowance so a burst of slow calls can be hedged straight away
+        self._tokens = 1.0
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there is too little history."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, float(np.percentile(self._latencies, self.percentile)))
+
+    async def _timed(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        result = await attempt()
+        self._latencies.append(time.perf_counter() - started)
+        return result
+
+    async def run(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Await attempt(), hedging it with a second call when it is slow."""
+        self.calls += 1
+        self._tokens = min(10.0, self._tokens + self.budget)
+        delay = self.delay() if self.enabled else None
+        if delay is None:
+            return await self._timed(attempt)
+
+        primary = asyncio.ensure_future(self._timed(attempt))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or self._tokens < 1:
+                return await primary
+
+            self._tokens -= 1
+            self.hedges += 1
+            logger.info("gemini_hedge delay=%.2f", delay)
+            tasks.add(asyncio.ensure_future(self._timed(attempt)))
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None or not tasks:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                # One attempt failed but the other is still running: wait for it
+        finally:
+            # The loser, or both when our caller was cancelled (e.g. by its deadline)
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        delay = self.delay() if self.enabled else None
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedges / self.calls if self.calls else 0.0,
+            "hedge_delay_seconds": delay if delay is not None else 0.0,
+        }
+
+
+gemini_hedger = Hedger(
+    GEMINI_HEDGE_ENABLED,
+    HEDGE_PERCENTILE,
+    HEDGE_WINDOW,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_MIN_DELAY,
+    HEDGE_BUDGET,
+)
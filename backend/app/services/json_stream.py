@@ -0,0 +1,120 @@
+from typing import Any, List, Optional, Tuple
+
+import orjson
+
+
+class IncrementalPlanParser:
+    """Incremental parser for a streamed visualization plan JSON object.
+
+    Text is fed in arbitrary chunks as it arrives from the model. Each top-level
+    field is reported once its value is complete, and every entry of the
+    "elements" array is reported on its own as soon as its object closes, so
+    callers never wait for the whole document. Anything before the first "{"
+    (such as a markdown fence) is ignored.
+    """
+
+    STREAMED_ARRAY = "elements"
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return the (field, value) pairs it completed.
+
+        Completed elements are reported as ("element", value).
+        """
+        self._buffer += chunk
+        events: List[Tuple[str, Any]] = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer) and not self.done:
+            ch = buffer[i]
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._close_string(i, events)
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    if self._key is None:
+                        self._key_start = i
+                    elif self._value_start is None:
+                        self._value_start = i
+            elif ch in "{[":
+                if self._depth == 1 and self._value_start is None:
+                    self._value_start = i
+                elif (
+                    self._depth == 2
+                    and ch == "{"
+                    and self._key == self.STREAMED_ARRAY
+                ):
+                    self._item_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 2 and self._item_start is not None:
+                    events.append(
+                        ("element", self._load(self._item_start, i + 1))
+                    )
+                    self._item_start = None
+                elif self._depth == 1 and self._value_start is not None:
+                    self._close_value(i + 1, events)
+                elif self._depth == 0:
+                    self._close_value(i, events)
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ",":
+                    self._close_value(i, events)
+                elif ch not in " \t\r\n:" and self._key is not None:
+                    if self._value_start is None:
+                        self._value_start = i
+            i += 1
+        self._pos = i
+        return events
+
+    def _close_string(self, end: int, events: List[Tuple[str, Any]]):
+        if self._depth != 1:
+            return
+        if self._key_start is not None:
+            self._key = self._load(self._key_start, end + 1)
+            self._key_start = None
+        elif self._value_start is not None:
+            self._close_value(end + 1, events)
+
+    def _close_value(self, end: int, events: List[Tuple[str, Any]]):
+        if self._key is None or self._value_start is None:
+            return
+        # Streamed array entries have already been reported one by one
+        if self._key != self.STREAMED_ARRAY:
+            text = self._buffer[self._value_start:end].strip()
+            if text:
+                events.append((self._key, orjson.loads(text)))
+        self._key = None
+        self._value_start = None
+
+    def _load(self, start: int, end: int) -> Any:
+        return orjson.loads(self._buffer[start:end])
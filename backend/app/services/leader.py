@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, and no multi-worker deployment either
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lock file shared by every worker on the host; its holder runs the background jobs
+LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH", "cache/leader.lock")
+# How often followers try to take over from a leader that has exited
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "10"))
+
+
+class LeaderLock:
+    """Leader election between the worker processes of one host via flock.
+
+    Exactly one process holds the exclusive lock at a time. The kernel drops
+    it when that process exits, however it exits, so a follower picks up
+    leadership on its next retry without any lease bookkeeping.
+    """
+
+    def __init__(self, path: str, retry_seconds: float):
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self._fd: Optional[int] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Take the lock without blocking; return whether this process now leads."""
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # Record the holder for whoever inspects the file
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+    async def run(self, jobs: List[Callable[[], Awaitable[None]]]):
+        """Wait for leadership, then run the jobs until cancelled.
+
+        Called from the app lifespan of every worker; only the leader's call
+        ever gets past the wait.
+        """
+        while not self.try_acquire():
+            await asyncio.sleep(self.retry_seconds)
+        logger.info("leader_elected pid=%d jobs=%d", os.getpid(), len(jobs))
+        tasks = [asyncio.create_task(job()) for job in jobs]
+        try:
+            await asyncio.gather(*tasks)
+            # One-off jobs such as cache warming are done; keep the lock so no follower repeats them
+            await asyncio.Event().wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.release()
+
+    def stats(self) -> dict:
+        # A number rather than a bool so it is exported as a gauge
+        return {"is_leader": int(self.is_leader)}
+
+
+leader_lock = LeaderLock(LEADER_LOCK_PATH, LEADER_RETRY_SECONDS)
@@ -0,0 +1,124 @@
+import logging
+import re
+from typing import List, Optional
+
+import orjson
+from pydantic import ValidationError
+
+from app.models.concept import VisualizationPlan
+
+logger = logging.getLogger(__name__)
+
+# Tokens that matter for structure: whole strings (the closing quote is missing
+# when the text was cut off inside one), brackets and commas
+_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*(")?|[{}\[\],]')
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def extract_json_object(text: str, allow_truncated: bool = True) -> Optional[str]:
+    """Return the outermost JSON object in model output, repaired if needed.
+
+    One pass from the first "{" finds the matching close, skipping over whole
+    strings so braces inside them don't count, and surrounding prose and
+    markdown fences fall away. Two common LLM defects are fixed on the way:
+    trailing commas are dropped, and output cut off mid-document is trimmed
+    back to the last complete array item or top-level field and closed,
+    unless allow_truncated is False. Returns None when there is no object to
+    recover.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    stack: List[str] = []
+    trailing_commas: List[int] = []
+    last_comma = -1
+    # Where to cut, and which containers are open there, if the text is truncated
+    safe_end = -1
+    safe_stack = ""
+
+    for match in _TOKEN_RE.finditer(text, start):
+        i = match.start()
+        ch = text[i]
+        if ch == ",":
+            last_comma = i
+            # A half-written nested object is dropped whole rather than kept missing fields
+            if len(stack) == 1 or stack[-1] == "[":
+                safe_end, safe_stack = i, "".join(stack)
+            continue
+        if ch == '"':
+            if match.group(1) is None:
+                break
+        elif ch == "{" or ch == "[":
+            stack.append(ch)
+            if ch == "[":
+                safe_end, safe_stack = i + 1, "".join(stack)
+        else:
+            if last_comma >= 0 and (last_comma == i - 1 or text[last_comma + 1:i].isspace()):
+                trailing_commas.append(last_comma)
+            if stack:
+                stack.pop()
+            if not stack:
+                return _drop(text, start, i + 1, trailing_commas)
+            safe_end, safe_stack = i + 1, "".join(stack)
+        last_comma = -1
+
+    if safe_end < 0 or not allow_truncated:
+        return None
+    kept = [pos for pos in trailing_commas if pos < safe_end]
+    body = _drop(text, start, safe_end, kept).rstrip().rstrip(",")
+    return body + "".join(_CLOSERS[ch] for ch in reversed(safe_stack))
+
+
+def _drop(text: str, start: int, end: int, positions: List[int]) -> str:
+    """Slice text[start:end] without the characters at the given positions."""
+    if not positions:
+        return text[start:end]
+    parts = []
+    for pos in positions:
+        parts.append(text[start:pos])
+        start = pos + 1
+    parts.append(text[start:end])
+    return "".join(parts)
+
+
+def _outer_slice(text: str) -> str:
+    # Well-formed output, fenced or not, is exactly the span from the first "{" to the last "}"
+    return text[text.find("{"):text.rfind("}") + 1]
+
+
+def loads_object(text: str, allow_truncated: bool = True) -> Optional[dict]:
+    """Parse the JSON object in model output with orjson, or return None."""
+    try:
+        return orjson.loads(_outer_slice(text))
+    except orjson.JSONDecodeError:
+        pass
+    extracted = extract_json_object(text, allow_truncated)
+    if extracted is None:
+        return None
+    try:
+        return orjson.loads(extracted)
+    except orjson.JSONDecodeError:
+        return None
+
+
+def parse_visualization(text: str, allow_truncated: bool = True) -> Optional[VisualizationPlan]:
+    """Extract, repair and validate a VisualizationPlan from model output in one step.
+
+    Well-formed output goes straight to model_validate_json; only when that
+    fails is the text scanned and repaired. With allow_truncated=False output
+    that was cut off is rejected rather than closed.
+    """
+    try:
+        return VisualizationPlan.model_validate_json(_outer_slice(text))
+    except ValidationError:
+        pass
+    extracted = extract_json_object(text, allow_truncated)
+    if extracted is None:
+        return None
+    try:
+        return VisualizationPlan.model_validate_json(extracted)
+    except ValidationError as e:
+        logger.warning("invalid_plan errors=%d", e.error_count())
+        return None
@@ -0,0 +1,136 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import List
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+# Optional OpenTelemetry tracing; spans are no-ops unless the package is installed and enabled
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+_tracer = trace.get_tracer("concept-visualizer") if trace and TRACING_ENABLED else None
+
+# Latency buckets in seconds, from a local classification up to a slow LLM call
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+_PARSE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.025)
+_TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+CLASSIFY_SECONDS = Histogram(
+    "concept_classify_seconds",
+    "Time to classify a concept",
+    ["source"],
+    buckets=_LATENCY_BUCKETS,
+)
+GENERATION_SECONDS = Histogram(
+    "visualization_generation_seconds",
+    "Time to generate a visualization plan, classification included",
+    ["mode"],
+    buckets=_LATENCY_BUCKETS,
+)
+JSON_PARSE_SECONDS = Histogram(
+    "visualization_json_parse_seconds",
+    "Time to extract and validate a plan from model output",
+    buckets=_PARSE_BUCKETS,
+)
+UPSTREAM_SECONDS = Histogram(
+    "gemini_request_seconds",
+    "Latency of single Gemini HTTP attempts",
+    ["status"],
+    buckets=_LATENCY_BUCKETS,
+)
+UPSTREAM_RESPONSES = Counter(
+    "gemini_responses_total",
+    "Gemini HTTP attempts by status code ('error' when no response arrived)",
+    ["status"],
+)
+GEMINI_TOKENS = Histogram(
+    "gemini_tokens",
+    "Token counts reported in Gemini usageMetadata",
+    ["kind"],
+    buckets=_TOKEN_BUCKETS,
+)
+VISUALIZATION_REQUESTS = Counter(
+    "visualization_requests_total",
+    "Visualization requests by category and source (cache, semantic or generated)",
+    ["category", "source"],
+)
+VISUALIZATIONS = Counter(
+    "visualizations_generated_total",
+    "Generated plans by category and whether the placeholder plan was used",
+    ["category", "fallback"],
+)
+
+_USAGE_FIELDS = {
+    "promptTokenCount": "prompt",
+    "candidatesTokenCount": "output",
+    "totalTokenCount": "total",
+}
+
+
+def record_usage(usage: dict):
+    """Record the token counts from a Gemini usageMetadata block."""
+    for field, kind in _USAGE_FIELDS.items():
+        if field in usage:
+            GEMINI_TOKENS.labels(kind).observe(usage[field])
+
+
+def record_visualization(result: dict):
+    VISUALIZATIONS.labels(result["category"], str(result["fallback"]).lower()).inc()
+
+
+class StatsCollector:
+    """Expose the numeric fields of a component's stats() dict as Prometheus gauges."""
+
+    def __init__(self, prefix: str, stats):
+        self.prefix = prefix
+        self.stats = stats
+
+    def collect(self):
+        for key, value in self.stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.prefix} {key}", value=value)
+
+
+_stats_collectors: List[StatsCollector] = []
+
+
+def register_stats(prefix: str, stats):
+    collector = StatsCollector(prefix, stats)
+    _stats_collectors.append(collector)
+    REGISTRY.register(collector)
+
+
+def register_stats_collectors(registry: CollectorRegistry):
+    """Add every registered stats() gauge to another registry, e.g. a multiprocess one.
+
+    Under gunicorn these gauges describe the worker that answered the scrape;
+    only counters and histograms are aggregated across workers.
+    """
+    for collector in _stats_collectors:
+        registry.register(collector)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Open a trace span when tracing is enabled, otherwise do nothing."""
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        yield
+
+
+@contextmanager
+def timed(histogram, *labels):
+    """Observe the wall time of the block on the histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        target = histogram.labels(*labels) if labels else histogram
+        target.observe(time.perf_counter() - start)
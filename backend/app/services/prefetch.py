@@ -0,0 +1,279 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.cache import make_cache_key, normalize_concept, visualization_cache
+from app.services.gemini_client import cache_namespace, is_cacheable
+from app.services.rate_limit import gemini_rate_limiter
+from app.services.resilience import gemini_breaker
+
+logger = logging.getLogger(__name__)
+
+# Speculative generation of the concepts a user is likely to ask for next
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+# Related concepts queued after each freshly generated plan
+PREFETCH_MAX_RELATED = int(os.getenv("PREFETCH_MAX_RELATED", "3"))
+# A follow-up seen fewer times than this is noise, not a pattern
+PREFETCH_MIN_CO_REQUESTS = int(os.getenv("PREFETCH_MIN_CO_REQUESTS", "2"))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "256"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+# Share of the rate limiter's burst that prefetching must leave untouched for live requests
+PREFETCH_QUOTA_RESERVE = float(os.getenv("PREFETCH_QUOTA_RESERVE", "0.5"))
+# Queued concepts older than this are dropped; the user has moved on
+PREFETCH_MAX_AGE_SECONDS = float(os.getenv("PREFETCH_MAX_AGE_SECONDS", "300"))
+# Requests from one client this close together count as one browsing session
+PREFETCH_SESSION_SECONDS = float(os.getenv("PREFETCH_SESSION_SECONDS", "900"))
+
+# Gemini calls one prefetch may make: classification plus generation
+_CALLS_PER_PREFETCH = 2
+# Prefetched plans remembered for hit accounting, and clients remembered for sessions
+_TRACKED = 4096
+# Element types that draw the diagram rather than name a concept
+_PRESENTATIONAL_TYPES = {
+    "arrow", "text", "line", "button", "slider", "label", "input", "toggle",
+    "control", "counter", "pointer", "legend", "grid", "caption", "title",
+}
+_DIGIT_RE = re.compile(r"\d")
+
+# Set while the prefetcher itself generates, so its plans don't schedule more prefetches
+_prefetching: ContextVar[bool] = ContextVar("prefetching", default=False)
+# Set while the cache warmer runs; its cache hits are not users asking for a prefetched plan
+_warming: ContextVar[bool] = ContextVar("warming", default=False)
+
+
+@contextmanager
+def warming():
+    """Mark work inside the block as cache warming rather than live traffic."""
+    token = _warming.set(True)
+    try:
+        yield
+    finally:
+        _warming.reset(token)
+
+
+def _label_concepts(result: dict) -> List[str]:
+    """Element labels that plausibly name a concept of their own, in plan order."""
+    labels = []
+    for element in result.get("visualization", {}).get("elements", []):
+        label = (element.get("label") or "").strip()
+        if (
+            (element.get("type") or "").lower() in _PRESENTATIONAL_TYPES
+            or not 3 <= len(label) <= 60
+            or len(label.split()) > 4
+            or _DIGIT_RE.search(label)
+        ):
+            continue
+        labels.append(label)
+    return labels
+
+
+class Prefetcher:
+    """Generate the concepts a user is likely to open next, using only spare quota.
+
+    After a plan is generated, related concepts are queued: first those other
+    users most often requested next (the co-request graph in the access log),
+    then the plan's own element labels. A queue ordered by that score feeds a
+    few background workers, which start a prefetch only when the circuit is
+    closed and the rate limiter has more than the reserve left with no live
+    request waiting. Prefetched plans go through the normal visualizer path,
+    so a user who asks while one is in flight joins it.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_related: int,
+        queue_size: int,
+        concurrency: int,
+        quota_reserve: float,
+        max_age: float,
+    ):
+        self.enabled = enabled
+        self.max_related = max_related
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.quota_reserve = quota_reserve
+        self.max_age = max_age
+        # Entries are (-score, seq, queued_at, concept, mode); seq keeps equal scores FIFO
+        self._queue: List[Tuple[float, int, float, str, Optional[str]]] = []
+        self._queued: Dict[Tuple[str, Optional[str]], float] = {}
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._prefetched: "OrderedDict[str, float]" = OrderedDict()
+        self._last_request: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.scheduled = 0
+        self.dropped = 0
+        self.expired = 0
+        self.already_cached = 0
+        self.deferred_seconds = 0
+        self.generated = 0
+        self.failed = 0
+        self.hits = 0
+
+    def observe_request(self, client: str, concept: str):
+        """Record which concept a client asked for after its previous one."""
+        now = time.monotonic()
+        previous = self._last_request.pop(client, None)
+        if previous is not None and now - previous[1] <= PREFETCH_SESSION_SECONDS:
+            visualization_cache.record_transition(previous[0], concept)
+        self._last_request[client] = (concept, now)
+        while len(self._last_request) > _TRACKED:
+            self._last_request.popitem(last=False)
+
+    async def related_concepts(self, concept: str, result: dict) -> List[Tuple[str, float]]:
+        """Concepts to prefetch after this one, best first, with their scores.
+
+        Observed follow-ups score above 1 by how often they follow; element
+        labels score below 1 by their position in the plan.
+        """
+        own = normalize_concept(concept)
+        scores: Dict[str, Tuple[str, float]] = {}
+        follow_ups = await visualization_cache.next_concepts(concept, self.max_related)
+        total = sum(count for _, count in follow_ups)
+        for target, count in follow_ups:
+            if count >= PREFETCH_MIN_CO_REQUESTS:
+                scores[target] = (target, 1 + count / total)
+        for rank, label in enumerate(_label_concepts(result)):
+            normalized = normalize_concept(label)
+            if normalized != own and normalized not in scores:
+                scores[normalized] = (label, 1 / (rank + 2))
+        return sorted(scores.values(), key=lambda item: -item[1])[: self.max_related]
+
+    async def schedule_related(self, concept: str, mode: Optional[str], result: dict):
+        """Queue the concepts related to a freshly generated plan."""
+        if not self.enabled or _prefetching.get():
+            return
+        for related, score in await self.related_concepts(concept, result):
+            self._push(related, mode, score)
+
+    def _push(self, concept: str, mode: Optional[str], score: float):
+        slot = (normalize_concept(concept), mode)
+        current = self._queued.get(slot)
+        if current is not None:
+            if current >= score:
+                return
+            # Seen again with a better score: move it up
+            self._remove(slot)
+        elif len(self._queued) >= self.queue_size:
+            lowest = max(self._queue)
+            if -lowest[0] >= score:
+                self.dropped += 1
+                return
+            self._remove((normalize_concept(lowest[3]), lowest[4]))
+            self.dropped += 1
+        self._queued[slot] = score
+        heapq.heappush(self._queue, (-score, next(self._seq), time.monotonic(), concept, mode))
+        self.scheduled += 1
+        self._ready.set()
+
+    def _remove(self, slot: Tuple[str, Optional[str]]):
+        del self._queued[slot]
+        self._queue = [
+            entry for entry in self._queue if (normalize_concept(entry[3]), entry[4]) != slot
+        ]
+        heapq.heapify(self._queue)
+
+    def _pop(self) -> Optional[Tuple[str, Optional[str]]]:
+        while self._queue:
+            _, _, queued_at, concept, mode = heapq.heappop(self._queue)
+            del self._queued[(normalize_concept(concept), mode)]
+            if time.monotonic() - queued_at > self.max_age:
+                self.expired += 1
+                continue
+            return concept, mode
+        self._ready.clear()
+        return None
+
+    def _has_spare_quota(self) -> bool:
+        if gemini_breaker.state != "closed":
+            return False
+        reserve = gemini_rate_limiter.capacity * self.quota_reserve
+        return gemini_rate_limiter.has_spare(_CALLS_PER_PREFETCH, reserve)
+
+    def record_hit(self, key: str):
+        """Count a live request served by a prefetched plan (once per plan)."""
+        if _warming.get() or _prefetching.get():
+            return
+        if self._prefetched.pop(key, None) is not None:
+            self.hits += 1
+
+    async def run(self, generate: Callable[[str, Optional[str]], Awaitable[dict]]):
+        """Work through the queue until cancelled; `generate` fetches and caches one plan."""
+        if not self.enabled:
+            return
+        # Inherited by every task started below, including the shared generation work
+        _prefetching.set(True)
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        try:
+            while True:
+                await self._ready.wait()
+                await slots.acquire()
+                while not self._has_spare_quota():
+                    self.deferred_seconds += 1
+                    await asyncio.sleep(1.0)
+                item = self._pop()
+                if item is None:
+                    slots.release()
+                    continue
+                task = asyncio.create_task(self._prefetch(generate, *item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _prefetch(self, generate, concept: str, mode: Optional[str]):
+        key = make_cache_key(concept, cache_namespace(mode))
+        if await visualization_cache.contains(key):
+            self.already_cached += 1
+            return
+        try:
+            result = await generate(concept, mode)
+        except Exception as e:
+            self.failed += 1
+            logger.info("prefetch_failed concept=%r error=%r", concept, str(e))
+            return
+        if not is_cacheable(result):
+            self.failed += 1
+            return
+        self.generated += 1
+        self._prefetched[key] = time.monotonic()
+        while len(self._prefetched) > _TRACKED:
+            self._prefetched.popitem(last=False)
+        logger.info("prefetched concept=%r", concept)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": len(self._queued),
+            "scheduled": self.scheduled,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "already_cached": self.already_cached,
+            "deferred_seconds": self.deferred_seconds,
+            "generated": self.generated,
+            "failed": self.failed,
+            "hits": self.hits,
+            # Share of the plans we spent quota on that a user then asked for
+            "hit_rate": self.hits / self.generated if self.generated else 0.0,
+        }
+
+
+prefetcher = Prefetcher(
+    PREFETCH_ENABLED,
+    PREFETCH_MAX_RELATED,
+    PREFETCH_QUEUE_SIZE,
+    PREFETCH_CONCURRENCY,
+    PREFETCH_QUOTA_RESERVE,
+    PREFETCH_MAX_AGE_SECONDS,
+)
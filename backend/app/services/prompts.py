@@ -0,0 +1,299 @@
+import math
+import os
+import zlib
+from typing import Dict
+
+import orjson
+
+# Bump whenever a prompt below changes, so cached plans are invalidated
+PROMPT_VERSION = "2"
+
+# maxOutputTokens for a visualization plan, with optional per-category overrides
+# given as a JSON object, e.g. {"History & Civilization": 1024}
+VISUALIZATION_MAX_TOKENS = int(os.getenv("VISUALIZATION_MAX_TOKENS", "768"))
+VISUALIZATION_TOKEN_BUDGETS: Dict[str, int] = orjson.loads(
+    os.getenv("VISUALIZATION_TOKEN_BUDGETS", "{}")
+)
+# Output budgets for classification: one short category name per concept
+CLASSIFY_MAX_TOKENS = 50
+CLASSIFY_TOKENS_PER_CONCEPT = 20
+# Gemini rejects a maxOutputTokens above the model's limit (8192 for gemini-2.0-flash)
+MODEL_MAX_OUTPUT_TOKENS = int(os.getenv("MODEL_MAX_OUTPUT_TOKENS", "8192"))
+# Concepts per batch classification call, so its output budget stays under that limit
+CLASSIFY_BATCH_SIZE = (MODEL_MAX_OUTPUT_TOKENS - CLASSIFY_MAX_TOKENS) // CLASSIFY_TOKENS_PER_CONCEPT
+# Room for the category name on top of the plan in the combined pipeline
+COMBINED_EXTRA_TOKENS = 32
+
+# Per-category guidance for the plan call, sent as part of the system instruction
+CATEGORY_PROMPTS = {
+    "Computer Science & Technology": """
+You are a world-class technical educator. Your job is to output a JSON object describing how to visually teach the following computer science concept.
+The response must be a JSON object that strictly adheres to the following structure:
+- title: A short title for the concept.
+- layout: A brief description of the overall visual arrangement (e.g., "A horizontal array of boxes representing memory slots...").
+- interaction: A description of the primary user interaction (e.g., "User clicks a 'Next Step' button to see the pointers move and values swap.").
+- elements: A list of visual element objects. Each object must have:
+  - label: The name or text on the element (e.g., "Array", "Pointer").
+  - type: The kind of element (e.g., "box", "arrow", "text").
+  - position: A descriptive position (e.g., "top-center", "dynamic").
+  - description: A short explanation of the element's role.
+""",
+    "Mathematics & Logic": """
+You are a top-tier math educator. Your job is to output a JSON object describing how to visually teach the following math or logic concept.
+The response must be a JSON object that strictly adheres to the following structure:
+- title: Short name of the concept.
+- layout: Description of the visual setup (e.g., "A Cartesian plane with X and Y axes...").
+- interaction: How the user interacts with the visual (e.g., "User can drag a point on the line to see the equation update.").
+- elements: A list of visual element objects. Each object must have:
+  - label: The name of the element (e.g., "X-axis", "Parabola").
+  - type: The kind of element (e.g., "graph", "equation-text", "point").
+  - position: Its location (e.g., "bottom", "top-right").
+  - description: Its purpose in the visualization.
+""",
+    "Physical Sciences": """
+You are a physics educator. Output a JSON object to visually explain a scientific principle, adhering to this structure:
+- title: Name of the principle.
+- layout: A description of the scene (e.g., "A central sun with planets orbiting in ellipses.").
+- interaction: A description of how the visual responds to user action or animates (e.g., "Animation plays showing the conservation of momentum as two objects collide.").
+- elements: A list of visual objects, each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Biological & Health Sciences": """
+You are a biology educator. Output a JSON object to visually explain a biological concept, adhering to this structure:
+- title: A clear title for the concept.
+- layout: A description of the biological diagram (e.g., "A cross-section of a plant cell with major organelles visible.").
+- interaction: A description of the dynamic aspect of the visual (e.g., "User clicks on an organelle to see its function displayed in a side panel.").
+- elements: A list of visual objects (e.g., 'Mitochondria', 'Cell Wall'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Social Sciences": """
+You are a sociologist. Output a JSON object to visually explain a social concept, adhering to this structure:
+- title: A title for the social concept.
+- layout: A description of the visual arrangement (e.g., "A network graph of nodes representing people and lines representing relationships.").
+- interaction: A description of how it works (e.g., "User can toggle different social filters to see how connections change.").
+- elements: A list of visual objects (e.g., 'Node', 'Connection', 'Group'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "History & Civilization": """
+You are a historian. Output a JSON object for a visual historical narrative, adhering to this structure:
+- title: The name of the historical event or topic.
+- layout: A description of the visual setup (e.g., "A vertical timeline with key dates, alongside an interactive map.").
+- interaction: A description of how the user explores (e.g., "Scrolling the timeline highlights corresponding locations on the map.").
+- elements: A list of visual objects (e.g., 'Event Marker', 'Map Region'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Philosophy & Ethics": """
+You are a philosopher. Output a JSON object to visualize a philosophical concept, adhering to this structure:
+- title: The name of the concept.
+- layout: A description of the abstract visual metaphor (e.g., "A set of balancing scales representing utilitarian calculus.").
+- interaction: A description of the interactive component (e.g., "User drags 'weights' of happiness onto the scales to see the ethical outcome.").
+- elements: A list of symbolic objects, each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Economics & Business": """
+You are an economist. Output a JSON object for a visual economic model, adhering to this structure:
+- title: The name of the concept.
+- layout: A description of the visual arrangement (e.g., "A standard supply and demand graph with price on the Y-axis and quantity on the X-axis.").
+- interaction: A description of how it's used (e.g., "User drags the demand curve to the right to see the new equilibrium point.").
+- elements: A list of visual objects (e.g., 'Supply Curve', 'Demand Curve'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Politics & Law": """
+You are a political scientist. Output a JSON object to visually explain a political concept, adhering to this structure:
+- title: The name of the concept.
+- layout: A description of the visual structure (e.g., "A flowchart showing the three branches of government.").
+- interaction: A description of how it works (e.g., "User clicks on a branch to expand it and see its powers and responsibilities.").
+- elements: A list of visual objects (e.g., 'Legislative Branch', 'Executive Branch'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Art & Design": """
+You are a design instructor. Output a JSON object to visually break down a design concept, adhering to this structure:
+- title: The name of the concept or principle.
+- layout: A description of the visual explanation (e.g., "A sample photograph with an overlay of the rule-of-thirds grid.").
+- interaction: A description of the interactive element (e.g., "User can drag the grid lines to see how it changes the composition's balance.").
+- elements: A list of visual objects (e.g., 'Grid Line', 'Focal Point'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Literature & Language": """
+You are a linguistics expert. Output a JSON object to visually represent a literary or linguistic idea, adhering to this structure:
+- title: The name of the concept.
+- layout: A description of the visual diagram (e.g., "A narrative arc plotted on a graph of tension versus time.").
+- interaction: A description of how it's explored (e.g., "User hovers over key points on the arc to read plot summaries for that stage.").
+- elements: A list of visual objects (e.g., 'Exposition', 'Climax', 'Resolution'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Media & Communication": """
+You are a communication theorist. Output a JSON object to visually model a media concept, adhering to this structure:
+- title: The name of the model or concept.
+- layout: A description of the diagram (e.g., "A diagram showing the Shannon-Weaver model of communication with all its parts.").
+- interaction: A description of the animation (e.g., "An animated icon travels from the sender to the receiver, transforming as it passes through the 'noise' element.").
+- elements: A list of visual objects (e.g., 'Sender', 'Encoder', 'Channel'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Education & Learning": """
+You are a pedagogy specialist. Output a JSON object to visually explain a learning concept, adhering to this structure:
+- title: The name of the educational theory or method.
+- layout: A description of the visual representation (e.g., "Bloom's Taxonomy shown as a multi-layered pyramid.").
+- interaction: A description of how it works (e.g., "User clicks on each level of the pyramid to see example learning activities and verbs.").
+- elements: A list of visual objects for each level, each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Environment & Sustainability": """
+You are an environmental scientist. Output a JSON object to visually explain an environmental concept, adhering to this structure:
+- title: The name of the concept.
+- layout: A description of the system diagram (e.g., "A flowchart of the carbon cycle showing atmospheric and terrestrial reservoirs.").
+- interaction: A description of the animation (e.g., "Carbon animates from the atmosphere to plants and back through respiration and decomposition.").
+- elements: A list of visual objects (e.g., 'Atmosphere', 'Plants', 'Fossil Fuels'), each with a 'label', 'type', 'position', and 'description'.
+""",
+    "Lifestyle & Personal Development": """
+You are a personal development coach. Output a JSON object to create an interactive tool, adhering to this structure:
+- title: The name of the concept or tool.
+- layout: A description of the visual tool (e.g., "A circular 'Wheel of Life' divided into 8 sections representing different life areas.").
+- interaction: A description of how the user engages (e.g., "User can click and drag each section's edge to rate their satisfaction from 1 to 10.").
+- elements: A list of visual objects for each life area (e.g., 'Career', 'Health'), each with a 'label', 'type', 'position', and 'description'.
+""",
+}
+
+
+# Compact per-category guidance for the combined pipeline, distilled from CATEGORY_PROMPTS
+CATEGORY_HINTS = {
+    "Computer Science & Technology": "technical educator; memory boxes, pointers, arrows; step-through interaction",
+    "Mathematics & Logic": "math educator; graphs, axes, equations, points; draggable parameters",
+    "Physical Sciences": "physics educator; physical scene with objects and forces; animation of the principle",
+    "Biological & Health Sciences": "biology educator; labelled diagram or cross-section; click a part to see its function",
+    "Social Sciences": "sociologist; network of people and relationships; toggle filters",
+    "History & Civilization": "historian; timeline alongside a map; scrolling highlights places",
+    "Philosophy & Ethics": "philosopher; abstract visual metaphor; user manipulates symbolic objects",
+    "Economics & Business": "economist; model graph with curves; drag a curve to see the new equilibrium",
+    "Politics & Law": "political scientist; flowchart of institutions; click to expand powers",
+    "Art & Design": "design instructor; sample artwork with overlay; drag guides to change composition",
+    "Literature & Language": "linguist; narrative or structural diagram; hover points for summaries",
+    "Media & Communication": "communication theorist; sender-to-receiver model; animated message flow",
+    "Education & Learning": "pedagogy specialist; layered model such as a pyramid; click levels for examples",
+    "Environment & Sustainability": "environmental scientist; system flowchart of reservoirs; animated cycle",
+    "Lifestyle & Personal Development": "personal development coach; interactive self-assessment tool; drag to rate",
+}
+
+# Shared instruction in front of every plan prompt. The response schema already
+# fixes the shape, so it is stated once here rather than repeated per call.
+_PLAN_PREAMBLE = "You design interactive educational visualizations. Reply with a single JSON object only: no markdown, code fences or commentary."
+
+_CATEGORY_LIST = "\n".join(CATEGORY_PROMPTS)
+_COMBINED_HINTS = "\n".join(f"- {name}: {hint}" for name, hint in CATEGORY_HINTS.items())
+
+_CLASSIFY_SYSTEM = f"""You are an intelligent classifier. Select the most appropriate category for the given concept from these options:
+{_CATEGORY_LIST}
+
+Respond with ONLY the exact category name from the list above."""
+
+_CLASSIFY_BATCH_SYSTEM = f"""You are an intelligent classifier. Select the most appropriate category for each given concept from these options:
+{_CATEGORY_LIST}
+
+Respond with a JSON array holding one exact category name per concept, in the same order."""
+
+_COMBINED_SYSTEM = f"""{_PLAN_PREAMBLE}
+
+First choose the category that best fits the concept, then describe how to visually teach it in the style of that category.
+
+Categories and their style hints:
+{_COMBINED_HINTS}
+
+The visualization must have a short title, a layout describing the overall visual arrangement, an interaction describing how the user engages with it, and a list of elements. Each element has a label, a type (e.g. "box", "arrow", "graph", "text"), a descriptive position, and a short description of its role."""
+
+_CONCEPT_TURN = 'Concept: "{concept}"'
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English prompt text, at about four characters per token."""
+    return math.ceil(len(text) / 4)
+
+
+class PromptTemplate:
+    """A prompt compiled once at startup.
+
+    The system instruction is fixed per template, so every call shares a
+    stable prefix that Gemini can cache. Only the user turn varies, and it is
+    rendered by concatenating around its single placeholder. Token counts
+    reported back by Gemini are accumulated per template, next to the
+    estimate made at compile time, to guide the output budgets.
+    """
+
+    def __init__(self, name: str, system: str, user: str, max_output_tokens: int):
+        self.name = name
+        self.system = system.strip()
+        self._before, _, rest = user.partition("{")
+        self._after = rest.partition("}")[2]
+        self.max_output_tokens = max_output_tokens
+        self.estimated_tokens = estimate_tokens(self.system + self._before + self._after)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    def render(self, value: str) -> "Prompt":
+        return Prompt(self, self._before + value + self._after)
+
+    def observe(self, usage: dict):
+        """Accumulate the usageMetadata of one call made with this template."""
+        self.calls += 1
+        self.prompt_tokens += usage.get("promptTokenCount", 0)
+        self.output_tokens += usage.get("candidatesTokenCount", 0)
+
+    def stats(self) -> dict:
+        return {
+            "estimated_prompt_tokens": self.estimated_tokens,
+            "max_output_tokens": self.max_output_tokens,
+            "calls": self.calls,
+            "mean_prompt_tokens": self.prompt_tokens / self.calls if self.calls else None,
+            "mean_output_tokens": self.output_tokens / self.calls if self.calls else None,
+        }
+
+
+class Prompt:
+    """A rendered prompt: the template's system instruction plus the user turn."""
+
+    __slots__ = ("template", "user")
+
+    def __init__(self, template: PromptTemplate, user: str):
+        self.template = template
+        self.user = user
+
+    @property
+    def system(self) -> str:
+        return self.template.system
+
+
+def _compile_prompts() -> Dict[str, PromptTemplate]:
+    unknown = set(VISUALIZATION_TOKEN_BUDGETS) - set(CATEGORY_PROMPTS)
+    if unknown:
+        raise ValueError(f"VISUALIZATION_TOKEN_BUDGETS names unknown categories: {sorted(unknown)}")
+
+    templates = [
+        PromptTemplate("classify", _CLASSIFY_SYSTEM, _CONCEPT_TURN, CLASSIFY_MAX_TOKENS),
+        # The output budget depends on the batch size and is set per call
+        PromptTemplate("classify_batch", _CLASSIFY_BATCH_SYSTEM, "Concepts:\n{concepts}", CLASSIFY_MAX_TOKENS),
+        PromptTemplate(
+            "combined",
+            _COMBINED_SYSTEM,
+            _CONCEPT_TURN,
+            max([VISUALIZATION_MAX_TOKENS, *VISUALIZATION_TOKEN_BUDGETS.values()]) + COMBINED_EXTRA_TOKENS,
+        ),
+    ]
+    for category, guidance in CATEGORY_PROMPTS.items():
+        templates.append(
+            PromptTemplate(
+                category,
+                f"{_PLAN_PREAMBLE}\n\n{guidance.strip()}",
+                _CONCEPT_TURN,
+                VISUALIZATION_TOKEN_BUDGETS.get(category, VISUALIZATION_MAX_TOKENS),
+            )
+        )
+    return {template.name: template for template in templates}
+
+
+PROMPTS = _compile_prompts()
+
+
+def visualization_prompt(category: str) -> PromptTemplate:
+    """The plan template for a category, falling back to Education & Learning."""
+    return PROMPTS.get(category) or PROMPTS["Education & Learning"]
+
+
+def budget_fingerprint() -> str:
+    """Identify the output budgets, which shape generated plans, for cache namespaces."""
+    if not VISUALIZATION_TOKEN_BUDGETS:
+        return str(VISUALIZATION_MAX_TOKENS)
+    overrides = orjson.dumps(VISUALIZATION_TOKEN_BUDGETS, option=orjson.OPT_SORT_KEYS)
+    return f"{VISUALIZATION_MAX_TOKENS}-{zlib.crc32(overrides):08x}"
+
+
+def prompt_stats() -> dict:
+    return {name: template.stats() for name, template in PROMPTS.items()}
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+
+# Client-side quota for outbound Gemini calls, for the whole host
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "2000"))
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "50"))
+# Worker processes sharing that quota; each limits itself to its share. Set by
+# gunicorn.conf.py, and read by uvicorn --workers as well
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Floor for the adaptive rate, as a fraction of the configured rate
+GEMINI_MIN_RATE_FRACTION = float(os.getenv("GEMINI_MIN_RATE_FRACTION", "0.1"))
+
+
+class TokenBucket:
+    """Async token bucket: refills at `rate` tokens per second up to `capacity`.
+
+    Waiters are served in arrival order, so a long batch cannot starve
+    interactive requests that queue up behind it. The rate adapts AIMD-style:
+    it halves whenever upstream throttles us and creeps back towards the
+    configured maximum with every successful call.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate_fraction: float = 1.0):
+        self.max_rate = rate
+        self.min_rate = rate * min_rate_fraction
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waits = 0
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` are available and take them."""
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                self.waits += 1
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+    def has_spare(self, tokens: float, reserve: float) -> bool:
+        """Whether `tokens` could be taken right now while leaving `reserve` for others.
+
+        Never true while a caller is queued in acquire(), so background work
+        that checks this first only ever uses quota nobody else is waiting for.
+        """
+        if self._lock.locked():
+            return False
+        self._refill()
+        return self._tokens - tokens >= reserve
+
+    def on_throttled(self):
+        """Upstream rejected a call for quota: halve the rate and drain the burst."""
+        self._refill()
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = min(self._tokens, 0.0)
+
+    def on_success(self):
+        """Recover a little of the rate lost to throttling."""
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.02)
+
+    def stats(self) -> dict:
+        # Computed without _refill(), so reading stats never changes the bucket
+        available = min(
+            self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate
+        )
+        return {
+            "rate_per_second": self.rate,
+            "max_rate_per_second": self.max_rate,
+            "throttled": self.throttled,
+            "capacity": self.capacity,
+            "available": available,
+            "waits": self.waits,
+        }
+
+
+gemini_rate_limiter = TokenBucket(
+    GEMINI_REQUESTS_PER_MINUTE / 60 / WEB_CONCURRENCY,
+    max(1.0, GEMINI_BURST / WEB_CONCURRENCY),
+    GEMINI_MIN_RATE_FRACTION,
+)
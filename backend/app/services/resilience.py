@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from app.services.deadline import remaining
+from app.services.errors import (
+    CircuitOpenError,
+    GeminiError,
+    GeminiRateLimitError,
+    GeminiServerError,
+    GeminiStatusError,
+    GeminiTransportError,
+)
+from app.services.http_client import get_http_client
+from app.services.metrics import UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+from app.services.rate_limit import gemini_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Retry configuration for outbound Gemini calls
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "8"))
+
+# Circuit breaker configuration
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failed calls in a row the circuit opens and calls
+    fail fast for `reset_seconds`. Then a single probe call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError unless a call may go through right now.
+
+        Returns True when this call is the half-open probe.
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+        raise CircuitOpenError(retry_after=max(remaining, 1.0))
+
+    def release_probe(self):
+        """Let another probe through after one was abandoned without an outcome."""
+        self._probing = False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._probing or self._failures >= self.failure_threshold:
+            if self._opened_at is None or self._probing:
+                self.opened += 1
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+gemini_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Read a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_for(response: httpx.Response, body: str) -> GeminiStatusError:
+    retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+    if response.status_code == 429:
+        return GeminiRateLimitError(response.status_code, body, retry_after)
+    if response.status_code >= 500:
+        return GeminiServerError(response.status_code, body, retry_after)
+    return GeminiStatusError(response.status_code, body, retry_after)
+
+
+def _cap_timeouts(request: httpx.Request):
+    """Shorten the request's httpx timeouts so an attempt cannot outlive the request deadline."""
+    left = remaining()
+    if left is None:
+        return
+    timeouts = request.extensions.get("timeout", {})
+    request.extensions["timeout"] = {
+        name: max(0.001, left if value is None else min(value, left))
+        for name, value in timeouts.items()
+    }
+
+
+def _backoff(attempt: int, error: GeminiError) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2**attempt))
+    if error.retry_after is not None:
+        delay = max(delay, error.retry_after)
+    return delay
+
+
+async def send_with_retries(request: httpx.Request, stream: bool = False) -> httpx.Response:
+    """Send a Gemini request through the rate limiter, circuit breaker and retry loop.
+
+    Returns the 200 response (still open when stream=True; the caller must close
+    it). Raises a GeminiError subclass once retries are exhausted or for errors
+    that retrying cannot fix, such as a 400 for a bad request.
+    """
+    attempt = 0
+    while True:
+        probe = gemini_breaker.before_call()
+        try:
+            # Waiting for a token happens after the probe slot is taken, so it is
+            # covered too: a caller cancelled here must not keep the slot
+            await gemini_rate_limiter.acquire()
+            _cap_timeouts(request)
+            started = time.perf_counter()
+            response = await get_http_client().send(request, stream=stream)
+        except httpx.HTTPError as e:
+            UPSTREAM_RESPONSES.labels("error").inc()
+            UPSTREAM_SECONDS.labels("error").observe(time.perf_counter() - started)
+            logger.warning("gemini_request_failed attempt=%d error=%r", attempt, str(e))
+            error: GeminiError = GeminiTransportError(f"Request failed - {str(e)}")
+        except BaseException:
+            # Cancelled (deadline, lost hedge) or failed without an outcome from upstream
+            if probe:
+                gemini_breaker.release_probe()
+            raise
+        else:
+            # For streams this is time to response headers, not to the last chunk
+            status = str(response.status_code)
+            UPSTREAM_RESPONSES.labels(status).inc()
+            UPSTREAM_SECONDS.labels(status).observe(time.perf_counter() - started)
+            if response.status_code == 200:
+                gemini_breaker.record_success()
+                gemini_rate_limiter.on_success()
+                return response
+            body = (await response.aread()).decode("utf-8", "replace")
+            await response.aclose()
+            logger.warning(
+                "gemini_error_status attempt=%d status=%d body=%r",
+                attempt, response.status_code, body[:500],
+            )
+            error = _error_for(response, body)
+
+        if isinstance(error, GeminiRateLimitError):
+            # Quota pressure is not an outage: slow down instead of tripping the breaker
+            gemini_rate_limiter.on_throttled()
+            if probe:
+                gemini_breaker.release_probe()
+        elif isinstance(error, (GeminiServerError, GeminiTransportError)):
+            gemini_breaker.record_failure()
+        else:
+            # Our own request was rejected; upstream is healthy and a retry won't help
+            gemini_breaker.record_success()
+            raise error
+
+        if attempt >= GEMINI_MAX_RETRIES:
+            raise error
+        delay = _backoff(attempt, error)
+        left = remaining()
+        if left is not None and left <= delay:
+            # The retry could not finish before the request's deadline anyway
+            raise error
+        attempt += 1
+        logger.info("gemini_retry attempt=%d max_retries=%d delay=%.2f", attempt, GEMINI_MAX_RETRIES, delay)
+        await asyncio.sleep(delay)
@@ -0,0 +1,366 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, and no multi-worker deployment either
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Semantic cache configuration
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_SIMILARITY_THRESHOLD", "0.88"))
+SEMANTIC_INDEX_PATH = os.getenv("SEMANTIC_INDEX_PATH", "cache/semantic_index")
+# The float32 matrix takes dim * max_entries * 4 bytes per worker: 41 MB at the defaults
+SEMANTIC_INDEX_DIM = int(os.getenv("SEMANTIC_INDEX_DIM", "512"))
+SEMANTIC_INDEX_MAX_ENTRIES = int(os.getenv("SEMANTIC_INDEX_MAX_ENTRIES", "20000"))
+# Write a snapshot in the background after this many inserts, besides the one at shutdown
+SEMANTIC_SNAPSHOT_EVERY = int(os.getenv("SEMANTIC_SNAPSHOT_EVERY", "100"))
+SEMANTIC_INDEX_MMAP = os.getenv("SEMANTIC_INDEX_MMAP", "true").lower() == "true"
+
+# Trailing "+" and "#" are kept so "C++", "C#" and "C" stay different concepts
+_TOKEN_RE = re.compile(r"[a-z0-9]+[+#]*")
+# Bumped whenever _embedding_features, concept_signature or the snapshot layout
+# changes, so older snapshots are not mixed in
+_FEATURES_VERSION = 4
+
+# Question phrasing and generic words that don't change which concept is meant
+_FILLER_WORDS = frozenset(
+    """
+    a an the of in on and or to for how does do did what is are was were why when
+    explain explained explanation work works working concept concepts about tell me
+    show visualize visualise visualization understanding understand introduction
+    intro basics basic algorithm algorithms
+    """.split()
+)
+
+
+def _stem(word: str) -> str:
+    # Plural "s" only; "ss" endings such as "process" are left alone
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _content_words(text: str) -> List[str]:
+    words = _TOKEN_RE.findall(text.lower())
+    return [_stem(word) for word in words if word not in _FILLER_WORDS] or words
+
+
+def concept_signature(text: str) -> str:
+    """The stemmed content words run together; two concepts can only match when these agree.
+
+    The embedding alone scores "supervised learning" close to "unsupervised
+    learning", since one is a substring of the other; the signature tells them apart.
+    """
+    return "".join(_content_words(text))
+
+
+def _embedding_features(text: str) -> List[str]:
+    """Content words plus character 3- and 4-grams of the words run together.
+
+    Running the words together makes "quick sort" and "quicksort" share
+    almost all of their n-grams.
+    """
+    content = _content_words(text)
+    features = [f"w:{word}" for word in content]
+    joined = "<" + "".join(content) + ">"
+    features += [f"c:{joined[i:i + 3]}" for i in range(len(joined) - 2)]
+    features += [f"d:{joined[i:i + 4]}" for i in range(len(joined) - 3)]
+    return features
+
+
+def embed(text: str, dim: int = SEMANTIC_INDEX_DIM) -> np.ndarray:
+    """Unit-length signed feature-hashing embedding of a concept."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in _embedding_features(text):
+        # crc32 rather than hash() so embeddings are stable across processes and snapshots
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticIndex:
+    """Nearest-neighbour index from concept embeddings to exact cache keys.
+
+    Vectors are stored column-wise in a (dim, capacity) float32 matrix that
+    doubles as entries are inserted, up to max_entries, after which the
+    oldest rows are overwritten. Because embeddings are sparse, a lookup only
+    reads the rows of the matrix for the query's non-zero buckets. Each entry
+    remembers its cache namespace so plans from another model, prompt or
+    pipeline mode are never matched.
+
+    A snapshot is a .json file of keys that names its own .npy matrix. The
+    matrix is written under a fresh name first and the .json replaced last,
+    so a reader always finds keys and vectors from the same save.
+    At startup the matrix is memory-mapped, so loading is quick whatever its
+    size; the first insert copies it into memory. Every worker snapshots the
+    same path, so a save first merges in what the others have written. The
+    file locking and I/O of a save run in worker threads, off the event loop.
+    """
+
+    def __init__(self, path: str, dim: int, max_entries: int, threshold: float, snapshot_every: int):
+        self.path = path
+        self.dim = dim
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.snapshot_every = snapshot_every
+        self._vectors = np.zeros((dim, 0), dtype=np.float32)
+        self._keys: List[str] = []
+        self._namespaces: List[str] = []
+        self._signatures: List[str] = []
+        self._namespace_ids = np.zeros(0, dtype=np.int32)
+        self._namespace_lookup: Dict[str, int] = {}
+        self._rows: Dict[str, int] = {}
+        self._size = 0
+        self._next_row = 0
+        self._loaded = False
+        self._unsaved = 0
+        self.lookups = 0
+        self.hits = 0
+        self.inserts = 0
+        self.snapshots = 0
+        self._save_lock = asyncio.Lock()
+        self._save_task: Optional[asyncio.Task] = None
+
+    def _namespace_id(self, namespace: str) -> int:
+        if namespace not in self._namespace_lookup:
+            self._namespace_lookup[namespace] = len(self._namespace_lookup)
+        return self._namespace_lookup[namespace]
+
+    def load(self):
+        """Load the snapshot if there is one. Called from the app lifespan; lookups load lazily otherwise."""
+        if self._loaded:
+            return
+        self._loaded = True
+        start = time.perf_counter()
+        # Shared, so a save cannot delete the matrix the snapshot names while it is opened
+        lock_fd = self._lock_snapshot(exclusive=False)
+        try:
+            snapshot = self._read_snapshot(mmap=SEMANTIC_INDEX_MMAP)
+        finally:
+            os.close(lock_fd)
+        if snapshot is None:
+            return
+        meta, vectors = snapshot
+
+        self._vectors = vectors
+        self._keys = meta["keys"]
+        self._namespaces = meta["namespaces"]
+        self._signatures = meta["signatures"]
+        self._namespace_ids = np.fromiter(
+            (self._namespace_id(namespace) for namespace in self._namespaces),
+            dtype=np.int32,
+            count=len(self._namespaces),
+        )
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+        self._size = len(self._keys)
+        self._next_row = meta.get("next_row", self._size) % self.max_entries
+        logger.info(
+            "semantic_index_loaded entries=%d seconds=%.4f", self._size, time.perf_counter() - start
+        )
+
+    def _read_snapshot(self, mmap: bool) -> Optional[Tuple[dict, np.ndarray]]:
+        """Return the snapshot's metadata and matrix, or None when there is no usable one.
+
+        Callers hold the lock file, shared or exclusive.
+        """
+        try:
+            with open(f"{self.path}.json", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dim") != self.dim or meta.get("features") != _FEATURES_VERSION:
+                logger.warning("semantic_index_mismatch path=%r dim=%r", self.path, meta.get("dim"))
+                return None
+            vectors_path = os.path.join(os.path.dirname(self.path), meta["vectors"])
+            vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("semantic_index_load_failed path=%r error=%r", self.path, str(e))
+            return None
+        if vectors.shape != (self.dim, len(meta["keys"])):
+            logger.warning("semantic_index_mismatch path=%r dim=%r", self.path, meta.get("dim"))
+            return None
+        return meta, vectors
+
+    def search(self, concept: str, namespace: str) -> Optional[Tuple[str, float]]:
+        """Return the cache key and similarity of the closest concept above the threshold.
+
+        Only concepts with the same signature (see concept_signature) are considered.
+        """
+        self.load()
+        self.lookups += 1
+        namespace_id = self._namespace_lookup.get(namespace)
+        if self._size == 0 or namespace_id is None:
+            return None
+
+        query = embed(concept, self.dim)
+        buckets = np.flatnonzero(query)
+        if buckets.size == 0:
+            return None
+        scores = query[buckets] @ self._vectors[buckets, : self._size]
+        scores[self._namespace_ids[: self._size] != namespace_id] = -1.0
+        candidates = np.flatnonzero(scores >= self.threshold)
+        signature = concept_signature(concept)
+        for row in candidates[np.argsort(-scores[candidates])]:
+            if self._signatures[row] == signature:
+                self.hits += 1
+                return self._keys[row], float(scores[row])
+        return None
+
+    def add(self, key: str, concept: str, namespace: str):
+        """Index a concept under its exact cache key; keys already present are skipped."""
+        self.load()
+        if key in self._rows:
+            return
+        self._insert(key, embed(concept, self.dim), namespace, concept_signature(concept))
+        self.inserts += 1
+
+        self._unsaved += 1
+        if self.snapshot_every and self._unsaved >= self.snapshot_every and self._save_task is None:
+            self._save_task = asyncio.get_running_loop().create_task(self.save())
+            self._save_task.add_done_callback(self._saved)
+
+    def _saved(self, task: asyncio.Task):
+        self._save_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("semantic_index_save_failed error=%r", str(task.exception()))
+
+    def _insert(self, key: str, vector: np.ndarray, namespace: str, signature: str):
+        if self._next_row >= self._vectors.shape[1]:
+            self._grow()
+        if not self._vectors.flags.writeable:
+            # Still backed by the read-only snapshot mapping
+            self._vectors = np.array(self._vectors, dtype=np.float32)
+
+        row = self._next_row
+        if row < self._size:
+            # The index is full: overwrite the oldest entry
+            del self._rows[self._keys[row]]
+            self._keys[row] = key
+            self._namespaces[row] = namespace
+            self._signatures[row] = signature
+        else:
+            self._keys.append(key)
+            self._namespaces.append(namespace)
+            self._signatures.append(signature)
+            self._size += 1
+        self._vectors[:, row] = vector
+        self._namespace_ids[row] = self._namespace_id(namespace)
+        self._rows[key] = row
+        self._next_row = (row + 1) % self.max_entries
+
+    def _grow(self):
+        capacity = min(self.max_entries, max(64, 2 * self._vectors.shape[1]))
+        vectors = np.zeros((self.dim, capacity), dtype=np.float32)
+        vectors[:, : self._size] = self._vectors[:, : self._size]
+        namespace_ids = np.zeros(capacity, dtype=np.int32)
+        namespace_ids[: self._size] = self._namespace_ids[: self._size]
+        self._vectors = vectors
+        self._namespace_ids = namespace_ids
+
+    def _merge_snapshot(self, snapshot: Optional[Tuple[dict, np.ndarray]]):
+        """Add the entries other workers have saved since this one loaded."""
+        if snapshot is None:
+            return
+        meta, vectors = snapshot
+        merged = 0
+        entries = zip(meta["keys"], meta["namespaces"], meta["signatures"])
+        for column, (key, namespace, signature) in enumerate(entries):
+            if key not in self._rows:
+                self._insert(key, vectors[:, column], namespace, signature)
+                merged += 1
+        if merged:
+            logger.info("semantic_index_merged entries=%d", merged)
+
+    async def save(self):
+        """Merge in the current snapshot, then replace it atomically with this index.
+
+        Locking, reading and writing the files run in worker threads; the merge
+        and the copy of the index that gets written happen on the event loop,
+        so lookups and inserts never see the index half-updated.
+        """
+        async with self._save_lock:
+            if not self._unsaved:
+                return
+            lock_fd = await asyncio.to_thread(self._lock_snapshot, True)
+            try:
+                self._merge_snapshot(await asyncio.to_thread(self._read_snapshot, True))
+                vectors = np.array(self._vectors[:, : self._size], dtype=np.float32)
+                meta = {
+                    "dim": self.dim,
+                    "features": _FEATURES_VERSION,
+                    "next_row": self._next_row,
+                    "keys": list(self._keys),
+                    "namespaces": list(self._namespaces),
+                    "signatures": list(self._signatures),
+                }
+                self._unsaved = 0
+                await asyncio.to_thread(self._write_snapshot, vectors, meta)
+            finally:
+                os.close(lock_fd)
+            self.snapshots += 1
+
+    def _lock_snapshot(self, exclusive: bool) -> int:
+        """Open and lock the snapshot's lock file; closing the descriptor releases it.
+
+        Saves hold it exclusively from reading the snapshot to replacing it, so
+        no worker's entries are lost in between; loads hold it shared.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return lock_fd
+
+    def _write_snapshot(self, vectors: np.ndarray, meta: dict):
+        # The matrix gets a name no earlier save used, and the .json that points
+        # at it is swapped in with a single rename, which is the commit point
+        tag = f"{os.getpid()}-{time.time_ns()}"
+        vectors_path = f"{self.path}.{tag}.npy"
+        np.save(vectors_path, vectors)
+        meta = dict(meta, vectors=os.path.basename(vectors_path))
+        tmp = f"{self.path}.{tag}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, f"{self.path}.json")
+        # Matrices of earlier saves; workers that memory-mapped one keep it until they unmap it
+        for old in glob.glob(f"{glob.escape(self.path)}.*.npy"):
+            if old != vectors_path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._size,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "inserts": self.inserts,
+            "snapshots": self.snapshots,
+            "threshold": self.threshold,
+        }
+
+
+semantic_index = SemanticIndex(
+    SEMANTIC_INDEX_PATH,
+    SEMANTIC_INDEX_DIM,
+    SEMANTIC_INDEX_MAX_ENTRIES,
+    SEMANTIC_SIMILARITY_THRESHOLD,
+    SEMANTIC_SNAPSHOT_EVERY,
+)
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.services.deadline import current_deadline, shared_deadline
+from app.services.errors import DeadlineExceededError
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """One shared task and the deadlines of the callers waiting on it."""
+
+    __slots__ = ("task", "waiters", "timer", "expired")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters: Dict[object, Optional[float]] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.expired = False
+
+    def deadline(self) -> Optional[float]:
+        """The latest waiter deadline; None while any waiter has no deadline."""
+        deadlines = list(self.waiters.values())
+        if not deadlines or None in deadlines:
+            return None
+        return max(deadlines)
+
+    def reschedule(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        deadline = self.deadline()
+        if deadline is not None and not self.task.done():
+            self.timer = asyncio.get_running_loop().call_later(
+                max(0.0, deadline - time.monotonic()), self.expire
+            )
+
+    def expire(self):
+        self.expired = True
+        self.task.cancel()
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key onto one shared task.
+
+    The first caller for a key starts the work as its own task; everyone who
+    arrives while it is running awaits that same task. Waiters are shielded, so
+    a caller that is cancelled (e.g. the client disconnected) stops waiting
+    without cancelling the work the others depend on. Exceptions reach every
+    waiter.
+
+    The work runs under the latest deadline among its live waiters, and is
+    cancelled once no waiter is left or when that deadline passes.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    async def do(self, key: str, work: Callable[[], Awaitable[T]]) -> T:
+        waiter = object()
+        flight = self._in_flight.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.waiters[waiter] = current_deadline()
+            with shared_deadline(flight.deadline):
+                flight.task = asyncio.ensure_future(work())
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda t: self._finish(key, flight))
+            self.leaders += 1
+        else:
+            flight.waiters[waiter] = current_deadline()
+            self.coalesced += 1
+        flight.reschedule()
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.expired and not asyncio.current_task().cancelling():
+                raise DeadlineExceededError("Deadline exceeded during shared work") from None
+            raise
+        finally:
+            del flight.waiters[waiter]
+            if not flight.task.done():
+                if flight.waiters:
+                    flight.reschedule()
+                else:
+                    # Nobody is left to use the result
+                    flight.task.cancel()
+
+    def _finish(self, key: str, flight: _Flight):
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        if flight.timer is not None:
+            flight.timer.cancel()
+        task = flight.task
+        if task.cancelled():
+            self.cancelled += 1
+        # Retrieve the exception so it is not reported as unhandled when every waiter left
+        elif task.exception() is not None:
+            self.errors += 1
+
+    async def drain(self, timeout: float) -> int:
+        """Wait up to `timeout` seconds for in-flight work; return how much was still running."""
+        tasks = [flight.task for flight in self._in_flight.values()]
+        if not tasks:
+            return 0
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        return len(pending)
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.coalesced
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "in_flight": len(self._in_flight),
+            "coalesced_rate": self.coalesced / calls if calls else 0.0,
+        }
+
+
+visualization_flight = SingleFlight()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from app.services.cache import make_cache_key, visualization_cache
+from app.services.deadline import (
+    REQUEST_DEADLINE_SECONDS,
+    deadline_after,
+    wait_within_deadline,
+)
+from app.services.gemini_client import (
+    PIPELINE_MODE,
+    cache_namespace,
+    classify_concepts,
+    is_cacheable,
+    generate_concept_visualization,
+    stream_concept_visualization,
+)
+from app.services.metrics import VISUALIZATION_REQUESTS
+from app.services.prefetch import prefetcher
+from app.services.semantic_cache import SEMANTIC_CACHE_ENABLED, semantic_index
+from app.services.singleflight import visualization_flight
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of batch items generated at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+
+async def get_visualization(
+    concept: str, mode: Optional[str] = None, category: Optional[str] = None
+) -> dict:
+    """Serve a visualization plan from cache, generating and storing it on a miss."""
+    mode = mode or PIPELINE_MODE
+    namespace = cache_namespace(mode)
+    key = make_cache_key(concept, namespace)
+    cached = await visualization_cache.get(key)
+    if cached is not None:
+        VISUALIZATION_REQUESTS.labels(cached["category"], "cache").inc()
+        prefetcher.record_hit(key)
+        return cached
+    cached = await _semantic_lookup(concept, namespace)
+    if cached is not None:
+        VISUALIZATION_REQUESTS.labels(cached["category"], "semantic").inc()
+        return cached
+
+    # Identical concepts already being generated share that work instead of calling Gemini again.
+    # It runs under the latest deadline among its waiters; a waiter whose own
+    # deadline passes first stops waiting without cancelling it for the others
+    result = await wait_within_deadline(
+        visualization_flight.do(key, lambda: _generate(key, concept, mode, category, namespace)),
+        "generation",
+    )
+    VISUALIZATION_REQUESTS.labels(result["category"], "generated").inc()
+    return result
+
+
+async def _semantic_lookup(concept: str, namespace: str) -> Optional[dict]:
+    """Serve the cached plan of a differently worded concept that means the same thing."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    match = semantic_index.search(concept, namespace)
+    if match is None:
+        return None
+    neighbour_key, similarity = match
+    # The neighbour's plan may have expired from the exact cache since it was indexed
+    cached = await visualization_cache.get(neighbour_key)
+    if cached is not None:
+        logger.info(
+            "semantic_hit concept=%r matched=%r similarity=%.3f",
+            concept, cached.get("concept"), similarity,
+        )
+    return cached
+
+
+def _store(key: str, concept: str, result: dict, namespace: str):
+    visualization_cache.set(key, concept, result)
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_index.add(key, concept, namespace)
+
+
+async def _generate(
+    key: str, concept: str, mode: str, category: Optional[str], namespace: str
+) -> dict:
+    result = await generate_concept_visualization(concept, mode, category)
+
+    # Never cache the placeholder plan, or a plan repaired from output that was cut off
+    if is_cacheable(result):
+        _store(key, concept, result, namespace)
+        await prefetcher.schedule_related(concept, mode, result)
+    return result
+
+
+async def stream_visualization(concept: str):
+    """Yield (event, data) pairs for a plan, replaying a cached plan when there is one.
+
+    Streaming always uses the two-step flow, so it shares cache entries with it.
+    """
+    namespace = cache_namespace("two_step")
+    key = make_cache_key(concept, namespace)
+    cached = await visualization_cache.get(key)
+    if cached is not None:
+        prefetcher.record_hit(key)
+    else:
+        cached = await _semantic_lookup(concept, namespace)
+    if cached is not None:
+        yield "category", {"category": cached["category"]}
+        for field, value in cached["visualization"].items():
+            if field == "elements":
+                for element in value:
+                    yield "element", element
+            else:
+                yield field, value
+        yield "done", cached
+        return
+
+    async for event, data in stream_concept_visualization(concept):
+        if event == "done" and is_cacheable(data):
+            _store(key, concept, data, namespace)
+            await prefetcher.schedule_related(concept, "two_step", data)
+        yield event, data
+
+
+async def get_visualizations(requests: List[tuple]):
+    """Yield (index, result) for (concept, mode, deadline_seconds) triples in completion order.
+
+    Cached plans are yielded first. Two-step misses are classified together up
+    front, then generated at most BATCH_CONCURRENCY at a time, each under its
+    own deadline counted from when it starts. A failed item yields its
+    exception as the result instead of aborting the batch.
+    """
+    modes = [mode or PIPELINE_MODE for _, mode, _ in requests]
+    pending = []
+    for index, (concept, _, _) in enumerate(requests):
+        key = make_cache_key(concept, cache_namespace(modes[index]))
+        cached = await visualization_cache.get(key)
+        if cached is not None:
+            yield index, cached
+        else:
+            pending.append(index)
+    if not pending:
+        return
+
+    categories = {}
+    two_step = [i for i in pending if modes[i] == "two_step"]
+    if two_step:
+        try:
+            classified = await classify_concepts([requests[i][0] for i in two_step])
+            categories = dict(zip(two_step, classified))
+        except Exception as e:
+            # Leave classification to each item, which reports its own failure
+            logger.warning("batch_classification_failed error=%r", str(e))
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(index: int):
+        concept, _, deadline = requests[index]
+        async with semaphore:
+            try:
+                with deadline_after(deadline or REQUEST_DEADLINE_SECONDS):
+                    result = await get_visualization(concept, modes[index], categories.get(index))
+            except Exception as e:
+                result = e
+        return index, result
+
+    tasks = [asyncio.ensure_future(run(index)) for index in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client went away mid-batch; drop the items still queued on the semaphore
+        for task in tasks:
+            task.cancel()
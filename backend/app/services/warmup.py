@@ -0,0 +1,218 @@
+"""Cache pre-warming: generate plans for a list of concepts ahead of user requests.
+
+Runs as a startup job on the leader worker (WARMUP_ON_STARTUP) or offline:
+
+    python -m app.services.warmup --file curriculum.txt --concurrency 8 --per-minute 120
+    python -m app.services.warmup --top 500 --checkpoint cache/warmup.checkpoint
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Iterable, List, Optional
+
+from app.services.cache import (
+    VIZ_CACHE_TTL_SECONDS,
+    make_cache_key,
+    normalize_concept,
+    visualization_cache,
+)
+from app.services.gemini_client import PIPELINE_MODE, cache_namespace, is_cacheable
+from app.services.prefetch import warming
+from app.services.rate_limit import TokenBucket
+from app.services.semantic_cache import semantic_index
+from app.services.visualizer import get_visualization
+
+logger = logging.getLogger(__name__)
+
+# Startup warming, run by the leader worker only
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+# Concept list to warm; without one, the most-requested concepts from the access log
+WARMUP_CONCEPTS_PATH = os.getenv("WARMUP_CONCEPTS_PATH", "")
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "200"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+# Concepts started per minute, kept well below the Gemini quota so live traffic keeps priority
+WARMUP_CONCEPTS_PER_MINUTE = float(os.getenv("WARMUP_CONCEPTS_PER_MINUTE", "60"))
+WARMUP_CHECKPOINT_PATH = os.getenv("WARMUP_CHECKPOINT_PATH", "cache/warmup.checkpoint")
+
+PROGRESS_EVERY = 50
+
+
+def load_concepts(path: str) -> List[str]:
+    """Read concepts from a text file (one per line, # for comments) or JSON.
+
+    JSON may be a list of concepts or a {category: [concepts]} mapping such
+    as the classifier's labelled_concepts.json.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+            if isinstance(data, dict):
+                return [concept for concepts in data.values() for concept in concepts]
+            return list(data)
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+def _unique(concepts: Iterable[str]) -> List[str]:
+    seen = set()
+    result = []
+    for concept in concepts:
+        normalized = normalize_concept(concept)
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            result.append(concept)
+    return result
+
+
+class Checkpoint:
+    """Append-only record of warmed concepts, so an interrupted run resumes where it stopped.
+
+    Records are cache keys with the time they were warmed. A key covers the
+    prompt version, model and mode, so a deploy that changes any of them
+    starts from scratch, and records older than the cache TTL are ignored
+    because their entries have expired.
+    """
+
+    def __init__(self, path: Optional[str], namespace: str):
+        self.path = path
+        self.namespace = namespace
+        self.done = set()
+        if path and os.path.exists(path):
+            cutoff = time.time() - VIZ_CACHE_TTL_SECONDS
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    key, _, warmed_at = line.strip().partition(" ")
+                    try:
+                        if float(warmed_at) > cutoff:
+                            self.done.add(key)
+                    except ValueError:
+                        continue  # A line in the old format, or one cut short by a crash
+
+    def _key(self, concept: str) -> str:
+        return make_cache_key(concept, self.namespace)
+
+    def __contains__(self, concept: str) -> bool:
+        return self._key(concept) in self.done
+
+    def add(self, concept: str):
+        key = self._key(concept)
+        self.done.add(key)
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # One short line per concept; a crash loses at most the line being written
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{key} {time.time():.0f}\n")
+
+
+async def warm_cache(
+    concepts: Iterable[str],
+    mode: Optional[str] = None,
+    concurrency: int = WARMUP_CONCURRENCY,
+    per_minute: float = WARMUP_CONCEPTS_PER_MINUTE,
+    checkpoint_path: Optional[str] = WARMUP_CHECKPOINT_PATH,
+) -> dict:
+    """Run concepts through the visualizer so their plans land in the cache.
+
+    Goes through get_visualization, so concepts that are already cached cost
+    nothing and plans are stored exactly as a live request would store them.
+    Failures are logged and left out of the checkpoint, so the next run
+    retries them. Returns counts of what happened.
+    """
+    checkpoint = Checkpoint(checkpoint_path, cache_namespace(mode or PIPELINE_MODE))
+    pending = [concept for concept in _unique(concepts) if concept not in checkpoint]
+    counts = {"total": len(pending), "warmed": 0, "fallback": 0, "failed": 0}
+    if not pending:
+        return counts
+
+    bucket = TokenBucket(per_minute / 60, 1)
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.monotonic()
+    logger.info(
+        "warmup_started concepts=%d skipped=%d concurrency=%d per_minute=%g",
+        len(pending), len(checkpoint.done), concurrency, per_minute,
+    )
+
+    async def warm(concept: str):
+        async with semaphore:
+            await bucket.acquire()
+            try:
+                result = await get_visualization(concept, mode)
+            except Exception as e:
+                counts["failed"] += 1
+                logger.warning("warmup_failed concept=%r error=%r", concept, str(e))
+                return
+        if not is_cacheable(result):
+            # Not cached, so leave it for the next run
+            counts["fallback"] += 1
+        else:
+            counts["warmed"] += 1
+            checkpoint.add(concept)
+        finished = counts["warmed"] + counts["fallback"] + counts["failed"]
+        if finished % PROGRESS_EVERY == 0:
+            logger.info("warmup_progress finished=%d total=%d", finished, counts["total"])
+
+    with warming():
+        await asyncio.gather(*(warm(concept) for concept in pending))
+    counts["seconds"] = round(time.monotonic() - started, 1)
+    logger.info("warmup_finished %s", " ".join(f"{k}={v}" for k, v in counts.items()))
+    return counts
+
+
+async def startup_concepts() -> List[str]:
+    """The concepts the startup job warms: the configured file, else the most requested."""
+    if WARMUP_CONCEPTS_PATH:
+        return load_concepts(WARMUP_CONCEPTS_PATH)
+    return [concept for concept, _ in await visualization_cache.top_concepts(WARMUP_TOP_N)]
+
+
+async def warm_on_startup():
+    """Leader job: warm the cache once after a deploy."""
+    try:
+        await warm_cache(await startup_concepts())
+    except Exception:
+        # Warming is best effort and must never take the worker down
+        logger.exception("warmup_aborted")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="Concept list: text, one per line, or JSON")
+    source.add_argument("--top", type=int, help="Warm the N most-requested concepts from the access log")
+    parser.add_argument("--mode", choices=("two_step", "combined"), default=None)
+    parser.add_argument("--concurrency", type=int, default=WARMUP_CONCURRENCY)
+    parser.add_argument("--per-minute", type=float, default=WARMUP_CONCEPTS_PER_MINUTE)
+    parser.add_argument("--checkpoint", default=WARMUP_CHECKPOINT_PATH, help="Empty string disables it")
+    return parser.parse_args(argv)
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    from app.services.http_client import close_http_client
+
+    concepts = load_concepts(args.file) if args.file else [
+        concept for concept, _ in await visualization_cache.top_concepts(args.top)
+    ]
+    try:
+        return await warm_cache(
+            concepts, args.mode, args.concurrency, args.per_minute, args.checkpoint or None
+        )
+    finally:
+        await close_http_client()
+        await semantic_index.save()
+        visualization_cache.close()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    counts = asyncio.run(_run(parse_args(argv)))
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
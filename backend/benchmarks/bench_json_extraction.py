@@ -0,0 +1,57 @@
+"""Micro-benchmark: LLM output extraction, old line-split/regex path vs app.services.llm_json.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_json_extraction
+"""
+
+import json
+import os
+import re
+import timeit
+
+from app.models.concept import VisualizationPlan
+from app.services.llm_json import parse_visualization
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "messy_outputs.json")
+NUMBER = 2000
+
+
+def legacy_parse(text: str):
+    """The extraction generate_concept_visualization used before llm_json."""
+    cleaned_response = text.strip()
+    if cleaned_response.startswith("```"):
+        lines = cleaned_response.split("\n")
+        if lines[0].strip().startswith("```"):
+            lines = lines[1:]
+        if lines and lines[-1].strip() == "```":
+            lines = lines[:-1]
+        cleaned_response = "\n".join(lines)
+    if not cleaned_response.strip().startswith("{"):
+        json_match = re.search(r"\{.*\}", cleaned_response, re.DOTALL)
+        if json_match:
+            cleaned_response = json_match.group(0)
+    try:
+        # The route then re-validated the dict through ConceptResponse
+        return VisualizationPlan.model_validate(json.loads(cleaned_response))
+    except (json.JSONDecodeError, ValueError):
+        return None
+
+
+def main():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    # "well_formed" is valid JSON wrapped in fences or prose; "defective" has
+    # trailing commas or was cut off at max_tokens
+    for group, texts in corpus.items():
+        print(f"{group} ({len(texts)} docs)")
+        for name, parse in (("legacy", legacy_parse), ("llm_json", parse_visualization)):
+            recovered = sum(parse(text) is not None for text in texts)
+            seconds = timeit.timeit(lambda: [parse(text) for text in texts], number=NUMBER)
+            per_doc_us = seconds / (NUMBER * len(texts)) * 1e6
+            print(f"  {name:>9}: {per_doc_us:7.1f} us/doc, recovered {recovered}/{len(texts)} plans")
+
+
+if __name__ == "__main__":
+    main()
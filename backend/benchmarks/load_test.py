@@ -0,0 +1,350 @@
+"""Load driver: throughput, latency percentiles and event-loop lag of the app against a mock Gemini.
+
+The FastAPI app is served by uvicorn on its own thread and event loop, and
+a sampler on that loop measures how late its timers fire (event-loop lag).
+The driver runs a fixed number of requests at each concurrency level and
+writes one JSON document with RPS, p50/p95/p99 latency and lag per level,
+so results can be diffed between releases.
+
+Unless --gemini-url is given, benchmarks.mock_gemini is started on a free
+port; arguments the driver does not know are passed on to it. Run from the
+backend directory:
+
+    python -m benchmarks.load_test --concurrency 1,8,32,128 --requests 200 \\
+        --output load.json --latency-ms 300 --error-rate 0.01
+
+The client-side Gemini quota is lifted (GEMINI_REQUESTS_PER_MINUTE) and the
+cache goes to a temporary file unless those variables are already set.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+LAG_INTERVAL = 0.01
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _summary_ms(samples: List[float]) -> dict:
+    """Percentiles of samples given in seconds, reported in milliseconds."""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    values = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "max": round(float(values.max()), 3),
+        "mean": round(float(values.mean()), 3),
+    }
+
+
+class LagMonitor:
+    """Samples how late a periodic timer fires on the loop it runs on."""
+
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def reset(self) -> List[float]:
+        samples, self.samples = self.samples, []
+        return samples
+
+
+class AppServer:
+    """Runs the FastAPI app under uvicorn on a background thread with its own event loop."""
+
+    def __init__(self, port: int):
+        import uvicorn
+
+        from app.main import app
+
+        # The lifespan is skipped so the keep-alive pinger never starts
+        config = uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.lag = LagMonitor()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread = threading.Thread(target=self._run, name="app-server", daemon=True)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        from app.services.classifier import get_classifier
+        from app.services.http_client import close_http_client, start_http_client
+
+        await start_http_client()
+        get_classifier()
+        lag_task = asyncio.create_task(self.lag.run())
+        try:
+            await self.server.serve()
+        finally:
+            lag_task.cancel()
+            await close_http_client()
+
+    def start(self):
+        self._thread.start()
+        while not self.server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("app server failed to start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
+
+    def reset_lag(self) -> List[float]:
+        """Return the lag samples since the last reset, read on the server loop."""
+        future = asyncio.run_coroutine_threadsafe(self._reset_lag(), self.loop)
+        return future.result()
+
+    async def _reset_lag(self) -> List[float]:
+        return self.lag.reset()
+
+
+def start_mock(port: int, mock_args: List[str]) -> subprocess.Popen:
+    """Launch benchmarks.mock_gemini and wait until it answers."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_gemini", "--port", str(port), *mock_args],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"mock Gemini exited with code {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("mock Gemini did not start")
+
+
+class ConceptSource:
+    """Concepts from the labelled examples, made unique unless a repeat is drawn."""
+
+    def __init__(self, repeat_ratio: float, seed: Optional[int]):
+        from app.services.classifier import CLASSIFIER_DATA_PATH
+
+        with open(CLASSIFIER_DATA_PATH, encoding="utf-8") as f:
+            labelled = json.load(f)
+        self.examples = [example for examples in labelled.values() for example in examples]
+        self.repeat_ratio = repeat_ratio
+        self.rng = random.Random(seed)
+        self.sent: List[str] = []
+
+    def next(self) -> str:
+        if self.sent and self.rng.random() < self.repeat_ratio:
+            return self.rng.choice(self.sent)
+        # A random letter tag rather than a counter: "x 1-1" and "x 1-2" are near
+        # duplicates to the semantic cache and would be served from it
+        tag = "".join(self.rng.choices(string.ascii_lowercase, k=12))
+        concept = f"{self.rng.choice(self.examples)} {tag}"
+        self.sent.append(concept)
+        return concept
+
+
+async def _visualize(client: httpx.AsyncClient, concept: str, mode: Optional[str]) -> dict:
+    start = time.perf_counter()
+    response = await client.post("/visualize", json={"concept": concept, "mode": mode})
+    elapsed = time.perf_counter() - start
+    return {"ok": response.status_code == 200, "status": response.status_code, "seconds": elapsed}
+
+
+async def _visualize_stream(client: httpx.AsyncClient, concept: str, mode: Optional[str]) -> dict:
+    start = time.perf_counter()
+    first_event = None
+    status = "200"
+    async with client.stream("POST", "/visualize/stream", json={"concept": concept}) as response:
+        if response.status_code != 200:
+            status = str(response.status_code)
+        async for line in response.aiter_lines():
+            if not line.startswith("event: "):
+                continue
+            if first_event is None:
+                first_event = time.perf_counter() - start
+            if line == "event: error":
+                status = "error_event"
+    elapsed = time.perf_counter() - start
+    return {"ok": status == "200", "status": status, "seconds": elapsed, "first_event": first_event}
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    concurrency: int,
+    requests: int,
+    concepts: ConceptSource,
+    mode: Optional[str],
+    timeout: float,
+) -> dict:
+    """Send `requests` requests from `concurrency` workers and summarize them."""
+    send = _visualize_stream if endpoint == "stream" else _visualize
+    results: List[dict] = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            try:
+                result = await asyncio.wait_for(send(client, concepts.next(), mode), timeout)
+            except asyncio.TimeoutError:
+                result = {"ok": False, "status": "timeout", "seconds": timeout}
+            except httpx.HTTPError as e:
+                result = {"ok": False, "status": type(e).__name__, "seconds": 0.0}
+            results.append(result)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    statuses: dict = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    ok = [r for r in results if r["ok"]]
+    level = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "statuses": statuses,
+        "seconds": round(wall, 3),
+        "rps": round(len(results) / wall, 2) if wall else None,
+        "latency_ms": _summary_ms([r["seconds"] for r in ok]),
+    }
+    if endpoint == "stream":
+        level["first_event_ms"] = _summary_ms(
+            [r["first_event"] for r in ok if r.get("first_event") is not None]
+        )
+    return level
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        epilog="Unrecognised arguments are passed to benchmarks.mock_gemini.",
+    )
+    parser.add_argument("--concurrency", default="1,8,32,128", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before the first level")
+    parser.add_argument("--endpoint", choices=("visualize", "stream"), default="visualize")
+    parser.add_argument("--mode", choices=("two_step", "combined"), default=None)
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Fraction of requests reusing an earlier concept")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--gemini-url", default=None, help="Use this Gemini API base instead of starting the mock")
+    parser.add_argument("--log-level", default="WARNING", help="App log level during the run")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write the JSON results here instead of stdout")
+    return parser.parse_known_args(argv)
+
+
+async def drive(args, levels: List[int], server: AppServer, base_url: str) -> List[dict]:
+    concepts = ConceptSource(args.repeat_ratio, args.seed)
+    results = []
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=None) as client:
+        if args.warmup:
+            await run_level(client, args.endpoint, min(args.warmup, max(levels)), args.warmup, concepts, args.mode, args.timeout)
+        for concurrency in levels:
+            server.reset_lag()
+            level = await run_level(
+                client, args.endpoint, concurrency, args.requests, concepts, args.mode, args.timeout
+            )
+            level["loop_lag_ms"] = _summary_ms(server.reset_lag())
+            print(
+                f"concurrency={concurrency} rps={level['rps']} p50={level['latency_ms']['p50']}ms "
+                f"p99={level['latency_ms']['p99']}ms lag_p99={level['loop_lag_ms']['p99']}ms "
+                f"errors={level['errors']}",
+                file=sys.stderr,
+            )
+            results.append(level)
+    return results
+
+
+def main(argv=None):
+    args, mock_args = parse_args(argv)
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    # These are read when the app modules are imported, so set them first
+    cache_dir = tempfile.TemporaryDirectory()
+    os.environ.setdefault("VIZ_CACHE_PATH", os.path.join(cache_dir.name, "visualizations.sqlite3"))
+    os.environ.setdefault("SEMANTIC_INDEX_PATH", os.path.join(cache_dir.name, "semantic_index"))
+    os.environ.setdefault("GEMINI_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("GEMINI_BURST", "10000")
+
+    mock = None
+    gemini_url = args.gemini_url
+    if gemini_url is None:
+        mock_port = _free_port()
+        if args.seed is not None:
+            mock_args = [*mock_args, "--seed", str(args.seed)]
+        mock = start_mock(mock_port, mock_args)
+        gemini_url = f"http://127.0.0.1:{mock_port}/v1beta"
+
+    from app.services.gemini_client import configure_gemini, get_gemini_settings
+
+    configure_gemini(api_base=gemini_url, api_key=get_gemini_settings().api_key or "load-test")
+    server = AppServer(_free_port())
+    logging.getLogger().setLevel(args.log_level)
+    try:
+        server.start()
+        levels_out = asyncio.run(drive(args, levels, server, f"http://127.0.0.1:{server.server.config.port}"))
+        mock_stats = httpx.get(gemini_url.rsplit("/", 1)[0] + "/stats").json() if mock else None
+    finally:
+        server.stop()
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+        cache_dir.cleanup()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "endpoint": args.endpoint,
+        "mode": args.mode,
+        "requests_per_level": args.requests,
+        "repeat_ratio": args.repeat_ratio,
+        "gemini_url": gemini_url,
+        "mock": mock_stats,
+        "levels": levels_out,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Local stand-in for the Gemini generateContent and streamGenerateContent endpoints.
+
+Answers look like real Gemini responses: classification requests get a
+category, batch classification an array, combined requests a category plus
+plan, and everything else a visualization plan from the benchmark corpus.
+Latency, error rates and malformed bodies are configurable so the app's
+retry, breaker and JSON-repair paths can be exercised without spending quota.
+
+Run from the backend directory:
+
+    python -m benchmarks.mock_gemini --port 8765 --latency-ms 400 --error-rate 0.02
+
+and point the app at it with GEMINI_API_BASE=http://127.0.0.1:8765/v1beta.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.services.llm_json import loads_object
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "messy_outputs.json")
+
+_NUMBERED_LINE_RE = re.compile(r"^\d+\. ", re.MULTILINE)
+
+
+@dataclass
+class MockConfig:
+    # Response latency: "fixed" at latency_ms, "uniform" on [0, 2 * latency_ms]
+    # or "lognormal" with median latency_ms and shape latency_sigma
+    latency_dist: str = "lognormal"
+    latency_ms: float = 400.0
+    latency_sigma: float = 0.5
+    # Fraction of requests answered 429 (with Retry-After) and 500
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    # Fraction of plan responses that are truncated or otherwise defective JSON
+    malformed_rate: float = 0.0
+    # Characters per server-sent event when streaming
+    stream_chunk_chars: int = 48
+    seed: Optional[int] = None
+
+
+class MockGemini:
+    """Builds canned Gemini responses according to a MockConfig."""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        with open(CORPUS_PATH, encoding="utf-8") as f:
+            corpus = json.load(f)
+        self.plan_texts: List[str] = corpus["well_formed"]
+        self.defective_texts: List[str] = corpus["defective"]
+        self.plans = [loads_object(text) for text in self.plan_texts]
+        self.requests = 0
+
+    def latency(self) -> float:
+        """Sample one response latency in seconds."""
+        config = self.config
+        if config.latency_dist == "fixed":
+            ms = config.latency_ms
+        elif config.latency_dist == "uniform":
+            ms = self.rng.uniform(0, 2 * config.latency_ms)
+        else:
+            ms = config.latency_ms * self.rng.lognormvariate(0, config.latency_sigma)
+        return ms / 1000
+
+    def failure(self) -> Optional[Response]:
+        """Return an error response for this request, or None to answer normally."""
+        roll = self.rng.random()
+        if roll < self.config.throttle_rate:
+            return Response(
+                orjson.dumps({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}),
+                status_code=429,
+                media_type="application/json",
+                headers={"Retry-After": "1"},
+            )
+        if roll < self.config.throttle_rate + self.config.error_rate:
+            return Response(
+                orjson.dumps({"error": {"code": 500, "status": "INTERNAL"}}),
+                status_code=500,
+                media_type="application/json",
+            )
+        return None
+
+    def answer(self, payload: dict) -> str:
+        """Return the model text for a generateContent payload."""
+        contents = [payload.get("systemInstruction", {}), *payload.get("contents", [])]
+        prompt = "".join(part.get("text", "") for content in contents for part in content.get("parts", []))
+        schema = payload.get("generationConfig", {}).get("responseSchema") or {}
+        malformed = self.rng.random() < self.config.malformed_rate
+
+        if schema.get("type") == "ARRAY":
+            count = len(_NUMBERED_LINE_RE.findall(prompt)) or 1
+            categories = schema["items"].get("enum") or ["Education & Learning"]
+            return orjson.dumps([self.rng.choice(categories) for _ in range(count)]).decode()
+        if schema.get("type") == "STRING" or prompt.startswith(
+            "You are an intelligent classifier"
+        ):
+            categories = schema.get("enum") or ["Computer Science & Technology"]
+            return self.rng.choice(categories)
+        if "category" in schema.get("properties", {}):
+            text = orjson.dumps(
+                {
+                    "category": self.rng.choice(schema["properties"]["category"]["enum"]),
+                    "visualization": self.rng.choice(self.plans),
+                }
+            ).decode()
+            return self._truncate(text) if malformed else text
+        if malformed:
+            return self.rng.choice(self.defective_texts)
+        return self.rng.choice(self.plan_texts)
+
+    def _truncate(self, text: str) -> str:
+        return text[: int(len(text) * self.rng.uniform(0.3, 0.9))]
+
+
+def _usage(prompt_chars: int, output_chars: int) -> dict:
+    # Roughly four characters per token
+    prompt, output = prompt_chars // 4, output_chars // 4
+    return {"promptTokenCount": prompt, "candidatesTokenCount": output, "totalTokenCount": prompt + output}
+
+
+def _chunk(text: str, finished: bool, usage: dict) -> dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate], "usageMetadata": usage}
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    mock = MockGemini(config)
+    app = FastAPI()
+
+    @app.get("/stats")
+    def stats():
+        return {"requests": mock.requests, "config": asdict(config)}
+
+    # The action is part of the last path segment, e.g. gemini-2.0-flash:generateContent
+    @app.post("/v1beta/models/{model_action}")
+    async def generate(model_action: str, request: Request):
+        mock.requests += 1
+        action = model_action.rpartition(":")[2]
+        body = await request.body()
+        payload = orjson.loads(body)
+        delay = mock.latency()
+
+        failure = mock.failure()
+        if failure is not None:
+            await asyncio.sleep(delay / 4)
+            return failure
+
+        text = mock.answer(payload)
+        usage = _usage(len(body), len(text))
+        if action == "generateContent":
+            await asyncio.sleep(delay)
+            return Response(orjson.dumps(_chunk(text, True, usage)), media_type="application/json")
+        if action != "streamGenerateContent":
+            return Response(status_code=404)
+
+        size = config.stream_chunk_chars
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        # A fifth of the latency goes to the first token, the rest is spread over the chunks
+        first_delay = delay / 5
+        chunk_delay = (delay - first_delay) / len(pieces)
+
+        async def events():
+            await asyncio.sleep(first_delay)
+            for n, piece in enumerate(pieces, 1):
+                chunk = _chunk(piece, n == len(pieces), usage)
+                yield b"data: " + orjson.dumps(chunk) + b"\r\n\r\n"
+                await asyncio.sleep(chunk_delay)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default=defaults.latency_dist)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--malformed-rate", type=float, default=defaults.malformed_rate)
+    parser.add_argument("--stream-chunk-chars", type=int, default=defaults.stream_chunk_chars)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        stream_chunk_chars=args.stream_chunk_chars,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Production runtime: gunicorn managing uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+Each worker is a separate process with its own event loop, Gemini connection
+pool and in-memory caches; the SQLite cache is shared between them. The
+Gemini rate limit is split evenly between workers (via WEB_CONCURRENCY), while
+the circuit breaker and hedging budget are kept per worker. Workers
+elect a leader over LEADER_LOCK_PATH, so background jobs run once per host.
+On SIGTERM gunicorn stops accepting connections and gives each worker
+graceful_timeout seconds to finish open requests and drain in-flight
+generations (SHUTDOWN_DRAIN_SECONDS) before it is killed.
+"""
+
+import multiprocessing
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# The workload waits on Gemini, so one event loop per core is enough
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+# Workers import the app after this file runs, so they divide the Gemini quota by the real count
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# Must exceed SHUTDOWN_DRAIN_SECONDS plus the longest request (REQUEST_DEADLINE_SECONDS),
+# or a worker is killed before it saves the semantic index and flushes the access log
+graceful_timeout = int(
+    os.getenv(
+        "GRACEFUL_TIMEOUT",
+        str(
+            int(float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20")))
+            + int(float(os.getenv("REQUEST_DEADLINE_SECONDS", "30")))
+            + 10
+        ),
+    )
+)
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+# Recycle workers now and then, staggered so they don't all restart together
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+# Workers import the app after forking, so nothing opened at import is shared between them
+preload_app = False
+accesslog = "-"
+
+# prometheus_client reads this when the workers import it, so /metrics can
+# aggregate every worker's counters and histograms
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/concept-visualizer-metrics"
+)
+
+
+def on_starting(server):
+    # Stale files from a previous run would be counted again
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
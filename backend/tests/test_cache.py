@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services.cache import VisualizationCache
+
+PLAN = {"category": "Mathematics", "visualization": {"title": "Primes", "elements": []}}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+def test_entries_survive_a_restart_through_the_disk_tier(path):
+    cache = VisualizationCache(path, 8, 60)
+    cache.set("key", "Prime numbers", PLAN)
+    cache.close()
+
+    reopened = VisualizationCache(path, 8, 60)
+    assert asyncio.run(reopened.get("key")) == PLAN
+    assert asyncio.run(reopened.get("key")) == PLAN
+    assert asyncio.run(reopened.get("other")) is None
+    stats = reopened.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (2, 1, 1)
+    reopened.close()
+
+
+def test_expired_entries_are_misses(path):
+    cache = VisualizationCache(path, 8, -1)
+    cache.set("key", "Prime numbers", PLAN)
+    assert asyncio.run(cache.get("key")) is None
+    assert cache.stats()["expirations"] >= 1
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_from_memory(path):
+    cache = VisualizationCache(path, 2, 60)
+    for key in ("a", "b", "c"):
+        cache.set(key, key, PLAN)
+    assert cache.stats()["evictions"] == 1 and cache.stats()["memory_entries"] == 2
+    cache.close()
+
+
+def test_disk_work_stays_off_the_event_loop_thread(path, monkeypatch):
+    cache = VisualizationCache(path, 8, 60)
+    threads = set()
+    connect = cache._connect
+    reader = cache._reader
+
+    def record(open_connection):
+        def wrapped():
+            threads.add(threading.get_ident())
+            return open_connection()
+
+        return wrapped
+
+    monkeypatch.setattr(cache, "_connect", record(connect))
+    monkeypatch.setattr(cache, "_reader", record(reader))
+
+    async def scenario():
+        cache.set("key", "Prime numbers", PLAN)
+        await cache._written_so_far()
+        cache._memory.clear()
+        assert await cache.get("key") == PLAN
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(scenario())
+    cache.close()
+    assert threads and loop_thread not in threads
+
+
+def test_access_log_counts_are_flushed_before_reading(path):
+    cache = VisualizationCache(path, 8, 60)
+    for concept in ("Binary search", "binary search ", "Photosynthesis"):
+        cache.record_request(concept)
+    cache.record_transition("binary search", "merge sort")
+
+    async def scenario():
+        return await cache.top_concepts(5), await cache.next_concepts("Binary Search", 5)
+
+    top, follow_ups = asyncio.run(scenario())
+    assert top == [("binary search", 2), ("photosynthesis", 1)]
+    assert follow_ups == [("merge sort", 1)]
+    cache.close()
@@ -0,0 +1,24 @@
+import asyncio
+
+import orjson
+
+from app.services import gemini_client
+from app.services.prompts import MODEL_MAX_OUTPUT_TOKENS
+
+
+def test_large_batches_are_split_under_the_output_token_limit(monkeypatch):
+    calls = []
+
+    async def fake_call(prompt, temperature, max_tokens, response_schema):
+        count = prompt.user.count("\n")
+        calls.append(max_tokens)
+        return orjson.dumps(["History & Civilization"] * count).decode()
+
+    monkeypatch.setattr(gemini_client, "classify_locally", lambda concept: (None, 0.0))
+    monkeypatch.setattr(gemini_client, "call_gemini_api", fake_call)
+    monkeypatch.setattr(gemini_client, "CLASSIFY_BATCH_SIZE", 400)
+    categories = asyncio.run(gemini_client.classify_concepts([f"concept {n}" for n in range(1000)]))
+
+    assert len(calls) == 3
+    assert all(max_tokens <= MODEL_MAX_OUTPUT_TOKENS for max_tokens in calls)
+    assert categories == ["History & Civilization"] * 1000
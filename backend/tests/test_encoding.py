@@ -0,0 +1,125 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.responses import Response, StreamingResponse
+
+from app.api import routes
+from app.services import encoding
+from app.services.encoding import CompressionMiddleware, make_etag, matching_etag, negotiate_encoding
+
+ETAG = make_etag(b"body")
+PLAN = {
+    "category": "Mathematics",
+    "visualization": {"title": "Primes " * 200, "elements": [{"label": "2", "type": "box"}]},
+    "fallback": False,
+    "partial": False,
+}
+
+
+@pytest.mark.parametrize(
+    "header",
+    [ETAG, "W/" + ETAG, ETAG[:-1] + '-gzip"', ETAG[:-1] + '-br"', '"other", ' + ETAG[:-1] + '-br"', "*"],
+)
+def test_matching_etag_accepts_every_variant_of_the_same_body(header):
+    assert matching_etag(header, ETAG) is not None
+
+
+def test_matching_etag_returns_the_clients_own_tag():
+    compressed = ETAG[:-1] + '-gzip"'
+    assert matching_etag(f'"other", {compressed}', ETAG) == compressed
+
+
+@pytest.mark.parametrize("header", [None, "", '"other"', make_etag(b"other body")])
+def test_matching_etag_rejects_other_bodies(header):
+    assert matching_etag(header, ETAG) is None
+
+
+def test_negotiate_encoding(monkeypatch):
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("identity") is None
+    monkeypatch.setattr(encoding, "brotli", None)
+    assert negotiate_encoding("br, gzip") == "gzip"
+
+
+def _app() -> TestClient:
+    app = FastAPI()
+    big = b'{"data": "' + b"x" * 4096 + b'"}'
+
+    @app.get("/big")
+    def big_response():
+        return Response(big, media_type="application/json", headers={"ETag": make_etag(big)})
+
+    @app.get("/small")
+    def small_response():
+        return Response(b"{}", media_type="application/json")
+
+    @app.get("/stream")
+    def streamed():
+        return StreamingResponse(iter([big, big]), media_type="application/json")
+
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+def test_complete_bodies_are_gzipped_with_a_suffixed_etag():
+    response = _app().get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].endswith('-gzip"')
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.json()["data"] == "x" * 4096
+
+
+def test_brotli_is_preferred_when_installed():
+    pytest.importorskip("brotli")
+    response = _app().get("/big", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["etag"].endswith('-br"')
+
+
+def test_small_and_streamed_bodies_are_not_compressed():
+    client = _app()
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    streamed = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in streamed.headers
+    assert len(streamed.content) == 2 * (4096 + 12)
+
+
+def test_no_compression_without_accept_encoding():
+    response = _app().get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+def _visualize_client(monkeypatch, result) -> TestClient:
+    async def fake_get_visualization(concept, mode=None, category=None):
+        return result
+
+    monkeypatch.setattr(routes, "get_visualization", fake_get_visualization)
+    monkeypatch.setattr(routes, "_observe", lambda request, concept: None)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+def test_cacheable_plan_revalidates_with_its_compressed_etag(monkeypatch):
+    client = _visualize_client(monkeypatch, PLAN)
+    first = client.get("/visualize/primes", headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200 and first.headers["etag"].endswith('-gzip"')
+    assert "max-age" in first.headers["cache-control"]
+
+    again = client.get(
+        "/visualize/primes",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]},
+    )
+    assert again.status_code == 304
+    assert again.headers["etag"] == first.headers["etag"]
+
+
+@pytest.mark.parametrize("flag", ["fallback", "partial"])
+def test_uncacheable_plan_is_sent_no_store_without_an_etag(monkeypatch, flag):
+    client = _visualize_client(monkeypatch, {**PLAN, flag: True})
+    response = client.get("/visualize/primes", headers={"If-None-Match": "*"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-store"
+    assert "etag" not in response.headers
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from app.services.hedging import Hedger
+
+
+def _hedger(budget: float = 1.0, tokens: float = 1.0) -> Hedger:
+    hedger = Hedger(True, 95, 100, 5, 0.01, budget)
+    # Recent calls took about 20ms, so the p95 delay is 20ms
+    hedger._latencies.extend([0.02] * 5)
+    hedger._tokens = tokens
+    return hedger
+
+
+class Attempts:
+    """Scripted attempts: each call takes the next (seconds, outcome) pair."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.started = []
+        self.cancelled = []
+
+    async def __call__(self):
+        n = len(self.started)
+        seconds, outcome = self.script[n]
+        self.started.append(asyncio.get_running_loop().time())
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            self.cancelled.append(n)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_no_hedge_while_there_is_too_little_history():
+    hedger = Hedger(True, 95, 100, 5, 0.01, 1.0)
+    attempts = Attempts((0.05, "first"))
+    assert asyncio.run(hedger.run(attempts)) == "first"
+    assert len(attempts.started) == 1 and hedger.delay() is None
+
+
+def test_fast_calls_are_not_hedged():
+    hedger = _hedger()
+    attempts = Attempts((0.001, "first"))
+    assert asyncio.run(hedger.run(attempts)) == "first"
+    assert hedger.hedges == 0
+
+
+def test_slow_call_is_hedged_after_the_percentile_delay_and_the_loser_cancelled():
+    hedger = _hedger()
+    attempts = Attempts((1.0, "slow"), (0.001, "hedge"))
+    assert asyncio.run(hedger.run(attempts)) == "hedge"
+    assert attempts.started[1] - attempts.started[0] == pytest.approx(0.02, abs=0.015)
+    assert attempts.cancelled == [0]
+    assert (hedger.hedges, hedger.hedge_wins) == (1, 1)
+
+
+def test_primary_can_still_win_after_the_hedge_starts():
+    hedger = _hedger()
+    attempts = Attempts((0.03, "primary"), (1.0, "hedge"))
+    assert asyncio.run(hedger.run(attempts)) == "primary"
+    assert attempts.cancelled == [1]
+    assert (hedger.hedges, hedger.hedge_wins) == (1, 0)
+
+
+def test_budget_caps_the_number_of_hedges():
+    hedger = _hedger(budget=0.0, tokens=1.0)
+
+    async def scenario():
+        results = []
+        for _ in range(3):
+            results.append(await hedger.run(Attempts((0.04, "slow"), (0.001, "hedge"))))
+        return results
+
+    assert asyncio.run(scenario()) == ["hedge", "slow", "slow"]
+    assert hedger.hedges == 1 and hedger.calls == 3
+
+
+def test_failed_attempt_waits_for_the_other():
+    hedger = _hedger()
+    attempts = Attempts((0.03, ValueError("primary failed")), (0.03, "hedge"))
+    assert asyncio.run(hedger.run(attempts)) == "hedge"
+
+
+def test_error_is_raised_when_both_attempts_fail():
+    hedger = _hedger()
+    attempts = Attempts((0.03, ValueError("primary failed")), (0.001, ValueError("hedge failed")))
+    with pytest.raises(ValueError):
+        asyncio.run(hedger.run(attempts))
+    assert hedger.hedges == 1 and hedger.hedge_wins == 0
+
+
+def test_cancelling_the_caller_cancels_both_attempts():
+    hedger = _hedger()
+    attempts = Attempts((1.0, "slow"), (1.0, "hedge"))
+
+    async def scenario():
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.05):
+                await hedger.run(attempts)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert sorted(attempts.cancelled) == [0, 1]
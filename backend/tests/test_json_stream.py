@@ -0,0 +1,77 @@
+import orjson
+import pytest
+
+from app.services.json_stream import IncrementalPlanParser
+
+PLAN = {
+    "title": 'Stacks: "LIFO" {push} [pop]',
+    "layout": "A vertical column of boxes \\ with a } brace",
+    "elements": [
+        {"label": "Top {of} stack", "type": "box", "position": {"x": 1, "y": [2, 3]}},
+        {"label": 'Say "hi"\n', "type": "arrow", "description": "]}"},
+        {"label": "Bottom", "type": "box"},
+    ],
+    "steps": 3,
+    "interactive": True,
+    "notes": None,
+}
+TEXT = "```json\n" + orjson.dumps(PLAN, option=orjson.OPT_INDENT_2).decode() + "\n```"
+
+EXPECTED = [("title", PLAN["title"]), ("layout", PLAN["layout"])]
+EXPECTED += [("element", element) for element in PLAN["elements"]]
+EXPECTED += [("steps", 3), ("interactive", True), ("notes", None)]
+
+
+def _feed(chunks):
+    parser = IncrementalPlanParser()
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    return parser, events
+
+
+def test_whole_document_in_one_chunk():
+    parser, events = _feed([TEXT])
+    assert events == EXPECTED
+    assert parser.done
+
+
+@pytest.mark.parametrize("split", range(len(TEXT) + 1))
+def test_split_at_every_offset(split):
+    parser, events = _feed([TEXT[:split], TEXT[split:]])
+    assert events == EXPECTED
+    assert parser.done
+
+
+def test_one_character_at_a_time():
+    parser, events = _feed(list(TEXT))
+    assert events == EXPECTED
+    assert parser.done
+
+
+def test_compact_json_without_whitespace():
+    text = orjson.dumps(PLAN).decode()
+    for size in (1, 2, 3, 7, 64):
+        _, events = _feed(text[i : i + size] for i in range(0, len(text), size))
+        assert events == EXPECTED
+
+
+@pytest.mark.parametrize("cut", range(len(TEXT)))
+def test_truncated_stream_reports_only_completed_parts(cut):
+    parser, events = _feed([TEXT[:cut]])
+    assert events == EXPECTED[: len(events)]
+    if cut < TEXT.rindex("}"):
+        assert not parser.done
+
+
+def test_elements_are_reported_before_the_array_closes():
+    text = orjson.dumps(PLAN).decode()
+    end_of_first = text.index('},{"label":"Say') + 1
+    _, events = _feed([text[:end_of_first]])
+    assert events[-1] == ("element", PLAN["elements"][0])
+
+
+def test_text_after_the_object_is_ignored():
+    parser, events = _feed(['{"title": "t"} trailing {"title": "other"}'])
+    assert events == [("title", "t")]
+    assert parser.done
@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import prefetch
+from app.services.cache import VisualizationCache
+from app.services.prefetch import Prefetcher, warming
+from app.services.rate_limit import TokenBucket
+from app.services.resilience import CircuitBreaker
+
+PLAN = {
+    "category": "Computer Science & Technology",
+    "visualization": {
+        "title": "Heap",
+        "elements": [
+            {"label": "Binary tree", "type": "box"},
+            {"label": "Next", "type": "button"},
+            {"label": "Array", "type": "box"},
+            {"label": "Step 1", "type": "box"},
+        ],
+    },
+    "fallback": False,
+    "partial": False,
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """Give each test its own cache file, breaker and rate limiter."""
+    cache = VisualizationCache(str(tmp_path / "cache.sqlite3"), 64, 60)
+    monkeypatch.setattr(prefetch, "visualization_cache", cache)
+    monkeypatch.setattr(prefetch, "gemini_breaker", CircuitBreaker(5, 60))
+    monkeypatch.setattr(prefetch, "gemini_rate_limiter", TokenBucket(1, 10))
+    yield cache
+    cache.close()
+
+
+def _prefetcher(queue_size: int = 8, max_age: float = 300, quota_reserve: float = 0.5) -> Prefetcher:
+    return Prefetcher(True, 3, queue_size, 2, quota_reserve, max_age)
+
+
+def _drain(prefetcher: Prefetcher):
+    popped = []
+    while (item := prefetcher._pop()) is not None:
+        popped.append(item[0])
+    return popped
+
+
+def test_queue_pops_best_score_first_and_equal_scores_in_order():
+    prefetcher = _prefetcher()
+    for concept, score in [("a", 0.5), ("b", 1.5), ("c", 0.5), ("d", 0.9)]:
+        prefetcher._push(concept, None, score)
+    assert _drain(prefetcher) == ["b", "d", "a", "c"]
+
+
+def test_a_concept_seen_again_with_a_better_score_moves_up():
+    prefetcher = _prefetcher()
+    prefetcher._push("a", None, 0.2)
+    prefetcher._push("b", None, 0.5)
+    prefetcher._push("A", None, 0.9)
+    prefetcher._push("b", None, 0.1)
+    assert _drain(prefetcher) == ["A", "b"]
+
+
+def test_full_queue_evicts_its_lowest_entry_only_for_a_better_one():
+    prefetcher = _prefetcher(queue_size=2)
+    prefetcher._push("a", None, 0.5)
+    prefetcher._push("b", None, 0.3)
+    prefetcher._push("c", None, 0.1)
+    assert prefetcher.dropped == 1
+    prefetcher._push("d", None, 0.9)
+    assert prefetcher.dropped == 2
+    assert _drain(prefetcher) == ["d", "a"]
+
+
+def test_entries_older_than_max_age_expire():
+    prefetcher = _prefetcher(max_age=0.01)
+    prefetcher._push("a", None, 0.5)
+    time.sleep(0.02)
+    prefetcher._push("b", None, 0.1)
+    assert _drain(prefetcher) == ["b"]
+    assert prefetcher.expired == 1
+
+
+def test_spare_quota_needs_a_closed_circuit_and_tokens_above_the_reserve(monkeypatch):
+    prefetcher = _prefetcher()
+    assert prefetcher._has_spare_quota()
+
+    prefetch.gemini_rate_limiter._tokens = 6
+    prefetch.gemini_rate_limiter.rate = 0
+    assert not prefetcher._has_spare_quota()
+
+    prefetch.gemini_rate_limiter._tokens = 10
+    breaker = prefetch.gemini_breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert not prefetcher._has_spare_quota()
+
+
+def test_related_concepts_skip_presentational_labels_and_the_concept_itself(isolated):
+    for _ in range(2):
+        isolated.record_transition("heap", "priority queue")
+    prefetcher = _prefetcher()
+
+    async def scenario():
+        isolated.flush_requests()
+        await isolated._written_so_far()
+        return await prefetcher.related_concepts("Heap", PLAN)
+
+    related = asyncio.run(scenario())
+    assert [concept for concept, _ in related] == ["priority queue", "Binary tree", "Array"]
+    assert related[0][1] > 1 > related[1][1] > related[2][1]
+
+
+def test_run_generates_queued_concepts_and_counts_hits():
+    prefetcher = _prefetcher()
+    generated = []
+
+    async def generate(concept, mode):
+        generated.append(concept)
+        return PLAN
+
+    async def scenario():
+        await prefetcher.schedule_related("Heap", None, PLAN)
+        worker = asyncio.ensure_future(prefetcher.run(generate))
+        await asyncio.sleep(0.05)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert sorted(generated) == ["Array", "Binary tree"]
+    assert prefetcher.generated == 2
+
+    key = next(iter(prefetcher._prefetched))
+    with warming():
+        prefetcher.record_hit(key)
+    assert prefetcher.hits == 0
+    prefetcher.record_hit(key)
+    prefetcher.record_hit(key)
+    assert prefetcher.hits == 1 and prefetcher.stats()["hit_rate"] == 0.5
+
+
+def test_run_waits_while_there_is_no_spare_quota(monkeypatch):
+    prefetcher = _prefetcher()
+    generated = []
+    monkeypatch.setattr(prefetcher, "_has_spare_quota", lambda: False)
+
+    async def generate(concept, mode):
+        generated.append(concept)
+        return PLAN
+
+    async def scenario():
+        prefetcher._push("heap", None, 1.0)
+        worker = asyncio.ensure_future(prefetcher.run(generate))
+        await asyncio.sleep(0.05)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert generated == [] and prefetcher.deferred_seconds == 1
@@ -0,0 +1,178 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.services import http_client, resilience
+from app.services.errors import CircuitOpenError, GeminiRateLimitError, GeminiServerError
+from app.services.rate_limit import TokenBucket
+from app.services.resilience import CircuitBreaker, send_with_retries
+
+URL = "http://gemini.test/v1beta/models/test:generateContent"
+
+
+class StubGemini:
+    """httpx transport that answers with a scripted list of responses."""
+
+    def __init__(self, *responses: httpx.Response):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Install a stub upstream plus a fresh breaker and rate limiter; return a setter for its script."""
+    monkeypatch.setattr(resilience, "gemini_breaker", CircuitBreaker(5, 60))
+    monkeypatch.setattr(resilience, "gemini_rate_limiter", TokenBucket(1000, 1000))
+    monkeypatch.setattr(resilience, "GEMINI_MAX_RETRIES", 3)
+    monkeypatch.setattr(resilience, "GEMINI_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(resilience, "GEMINI_BACKOFF_MAX", 0.01)
+
+    def install(*responses: httpx.Response) -> StubGemini:
+        transport = StubGemini(*responses)
+        monkeypatch.setattr(
+            http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(transport))
+        )
+        return transport
+
+    return install
+
+
+def _send():
+    request = http_client.get_http_client().build_request("POST", URL, json={})
+    return asyncio.run(send_with_retries(request))
+
+
+def test_retries_server_errors_until_success(stub):
+    upstream = stub(httpx.Response(500), httpx.Response(503), httpx.Response(200, json={"ok": True}))
+    response = _send()
+    assert response.status_code == 200
+    assert upstream.calls == 3
+    assert resilience.gemini_breaker.state == "closed"
+
+
+def test_gives_up_after_max_retries(stub):
+    upstream = stub(*[httpx.Response(500) for _ in range(4)])
+    with pytest.raises(GeminiServerError):
+        _send()
+    assert upstream.calls == 4
+
+
+def test_client_errors_are_not_retried(stub):
+    upstream = stub(httpx.Response(400, text="bad request"))
+    with pytest.raises(Exception) as error:
+        _send()
+    assert getattr(error.value, "status_code", None) == 400
+    assert upstream.calls == 1
+    assert resilience.gemini_breaker.state == "closed"
+
+
+def test_throttling_honours_retry_after(stub, monkeypatch):
+    slept = []
+
+    async def fake_sleep(delay):
+        slept.append(delay)
+
+    monkeypatch.setattr(resilience.asyncio, "sleep", fake_sleep)
+    stub(httpx.Response(429, headers={"Retry-After": "2"}), httpx.Response(200, json={}))
+    assert _send().status_code == 200
+    assert slept and slept[0] >= 2
+    # Quota pressure slows the limiter down but is not counted as an outage
+    assert resilience.gemini_rate_limiter.throttled == 1
+    assert resilience.gemini_breaker.stats()["consecutive_failures"] == 0
+
+
+def test_throttling_raises_rate_limit_error_when_retries_run_out(stub, monkeypatch):
+    monkeypatch.setattr(resilience, "GEMINI_MAX_RETRIES", 0)
+    stub(httpx.Response(429, headers={"Retry-After": "1"}))
+    with pytest.raises(GeminiRateLimitError) as error:
+        _send()
+    assert error.value.retry_after == 1
+
+
+def test_retry_after_accepts_http_dates():
+    header = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 25 <= resilience._parse_retry_after(header) <= 31
+    assert resilience._parse_retry_after("garbage") is None
+
+
+def test_breaker_opens_then_probes_and_closes(stub, monkeypatch):
+    monkeypatch.setattr(resilience, "GEMINI_MAX_RETRIES", 0)
+    stub(*[httpx.Response(500) for _ in range(5)], httpx.Response(200, json={}))
+    for _ in range(5):
+        with pytest.raises(GeminiServerError):
+            _send()
+    breaker = resilience.gemini_breaker
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        _send()
+
+    breaker.reset_seconds = 0
+    assert breaker.state == "half_open"
+    assert _send().status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_probe_cancelled_while_waiting_for_a_token_is_released(stub, monkeypatch):
+    upstream = stub(httpx.Response(200, json={}))
+    breaker = resilience.gemini_breaker
+    breaker._opened_at = time.monotonic() - breaker.reset_seconds
+    # An empty bucket that refills slowly, so the probe is stuck in acquire()
+    bucket = TokenBucket(0.1, 1)
+    bucket._tokens = 0
+    monkeypatch.setattr(resilience, "gemini_rate_limiter", bucket)
+
+    async def probe_times_out():
+        request = http_client.get_http_client().build_request("POST", URL, json={})
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.05):
+                await send_with_retries(request)
+
+    asyncio.run(probe_times_out())
+    assert breaker.state == "half_open"
+    assert not breaker._probing
+
+    # The next call becomes the probe instead of being rejected
+    monkeypatch.setattr(resilience, "gemini_rate_limiter", TokenBucket(1000, 1000))
+    assert _send().status_code == 200
+    assert breaker.state == "closed"
+    assert upstream.calls == 1
+
+
+def test_cancelling_a_call_admitted_while_closed_keeps_the_probe_slot(stub, monkeypatch):
+    release = asyncio.Event()
+
+    async def slow_upstream(request):
+        await release.wait()
+        return httpx.Response(200, json={})
+
+    monkeypatch.setattr(
+        http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(slow_upstream))
+    )
+    breaker = resilience.gemini_breaker
+
+    async def scenario():
+        client = http_client.get_http_client()
+        admitted_closed = asyncio.ensure_future(
+            send_with_retries(client.build_request("POST", URL, json={}))
+        )
+        await asyncio.sleep(0.01)
+        breaker._opened_at = time.monotonic() - breaker.reset_seconds
+        probe = asyncio.ensure_future(send_with_retries(client.build_request("POST", URL, json={})))
+        await asyncio.sleep(0.01)
+        admitted_closed.cancel()
+        await asyncio.gather(admitted_closed, return_exceptions=True)
+
+        assert breaker._probing
+        with pytest.raises(CircuitOpenError):
+            await send_with_retries(client.build_request("POST", URL, json={}))
+        release.set()
+        assert (await probe).status_code == 200
+
+    asyncio.run(scenario())
+    assert breaker.state == "closed"
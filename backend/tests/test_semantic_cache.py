@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services.semantic_cache import SemanticIndex
+
+NAMESPACE = "test-model:p2:two_step"
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SemanticIndex(str(tmp_path / "index"), 1024, 1000, 0.88, 0)
+
+
+@pytest.mark.parametrize(
+    "stored, query",
+    [
+        ("quick sort", "Quicksort algorithm"),
+        ("quick sort", "how does quicksort work"),
+        ("binary search trees", "Binary Search Tree"),
+    ],
+)
+def test_rewordings_match(index, stored, query):
+    index.add("key", stored, NAMESPACE)
+    assert index.search(query, NAMESPACE)[0] == "key"
+
+
+@pytest.mark.parametrize(
+    "stored, query",
+    [
+        ("supervised machine learning", "unsupervised machine learning"),
+        ("renewable energy sources", "non-renewable energy sources"),
+        ("sexual reproduction", "asexual reproduction"),
+        ("C", "C++"),
+    ],
+)
+def test_opposite_concepts_sharing_a_stem_do_not_match(index, stored, query):
+    index.add("key", stored, NAMESPACE)
+    assert index.search(query, NAMESPACE) is None
+    assert index.search(stored, NAMESPACE)[0] == "key"
+
+
+def test_other_namespaces_are_not_matched(index):
+    index.add("key", "quick sort", NAMESPACE)
+    assert index.search("quicksort", "other-model:p2:two_step") is None
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "index")
+    index = SemanticIndex(path, 1024, 1000, 0.88, 0)
+    index.add("key", "quick sort", NAMESPACE)
+    asyncio.run(index.save())
+
+    reloaded = SemanticIndex(path, 1024, 1000, 0.88, 0)
+    assert reloaded.search("Quicksort", NAMESPACE)[0] == "key"
+    assert reloaded.search("merge sort", NAMESPACE) is None
+
+
+def test_snapshots_are_written_in_the_background_and_merged(tmp_path):
+    path = str(tmp_path / "index")
+    first = SemanticIndex(path, 1024, 1000, 0.88, 2)
+    second = SemanticIndex(path, 1024, 1000, 0.88, 0)
+
+    async def scenario():
+        second.add("merge", "merge sort", NAMESPACE)
+        await second.save()
+        first.add("quick", "quick sort", NAMESPACE)
+        first.add("heap", "heap sort", NAMESPACE)
+        # The insert that reaches snapshot_every only schedules the save
+        assert first.snapshots == 0 and first._save_task is not None
+        await first._save_task
+
+    asyncio.run(scenario())
+    assert first.snapshots == 1
+    reloaded = SemanticIndex(path, 1024, 1000, 0.88, 0)
+    assert {reloaded.search(c, NAMESPACE)[0] for c in ("merge sort", "quick sort", "heap sort")} == {
+        "merge", "quick", "heap"
+    }
+
+
+def test_each_save_commits_a_new_matrix_through_the_json(tmp_path):
+    path = str(tmp_path / "index")
+    index = SemanticIndex(path, 1024, 1000, 0.88, 0)
+    index.add("quick", "quick sort", NAMESPACE)
+    asyncio.run(index.save())
+    first = json.loads((tmp_path / "index.json").read_text())["vectors"]
+
+    index.add("heap", "heap sort", NAMESPACE)
+    asyncio.run(index.save())
+    second = json.loads((tmp_path / "index.json").read_text())["vectors"]
+
+    assert first != second
+    assert [p.name for p in tmp_path.glob("*.npy")] == [second]
+    reloaded = SemanticIndex(path, 1024, 1000, 0.88, 0)
+    assert reloaded.search("heap sort", NAMESPACE)[0] == "heap"
+    assert reloaded.search("quick sort", NAMESPACE)[0] == "quick"
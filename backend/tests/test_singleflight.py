@@ -0,0 +1,172 @@
+import asyncio
+
+from app.services.deadline import deadline_after, remaining, wait_within_deadline
+from app.services.errors import DeadlineExceededError
+from app.services.singleflight import SingleFlight
+
+
+class Work:
+    """Shared work that records the deadline it saw and whether it was cancelled."""
+
+    def __init__(self, seconds: float = 10.0):
+        self.seconds = seconds
+        self.remaining = []
+        self.cancelled = False
+
+    async def __call__(self):
+        self.remaining.append(remaining())
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return "done"
+
+
+async def _call(flight: SingleFlight, work: Work, deadline: float):
+    with deadline_after(deadline):
+        return await wait_within_deadline(flight.do("key", work), "generation")
+
+
+def test_work_is_cancelled_once_every_waiter_has_left():
+    flight, work = SingleFlight(), Work()
+
+    async def scenario():
+        callers = [asyncio.ensure_future(_call(flight, work, 10)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not work.cancelled
+        callers[1].cancel()
+        await asyncio.sleep(0.01)
+        await asyncio.gather(*callers, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert work.cancelled
+    assert flight.stats()["cancelled"] == 1 and flight.stats()["in_flight"] == 0
+
+
+def test_work_runs_under_the_latest_waiter_deadline_and_stops_there():
+    flight, work = SingleFlight(), Work()
+
+    async def scenario():
+        short = asyncio.ensure_future(_call(flight, work, 0.05))
+        await asyncio.sleep(0)
+        long = asyncio.ensure_future(_call(flight, work, 0.15))
+        return await asyncio.gather(short, long, return_exceptions=True)
+
+    short, long = asyncio.run(scenario())
+    assert isinstance(short, DeadlineExceededError)
+    assert isinstance(long, DeadlineExceededError)
+    assert work.cancelled
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_latest_deadline_keeps_work_alive_after_the_starter_gives_up():
+    flight, work = SingleFlight(), Work(seconds=0.1)
+
+    async def scenario():
+        short = asyncio.ensure_future(_call(flight, work, 0.03))
+        await asyncio.sleep(0)
+        long = asyncio.ensure_future(_call(flight, work, 1))
+        return await asyncio.gather(short, long, return_exceptions=True)
+
+    short, long = asyncio.run(scenario())
+    assert isinstance(short, DeadlineExceededError)
+    assert long == "done" and not work.cancelled
+
+
+def test_shared_work_sees_the_latest_deadline_among_waiters():
+    flight = SingleFlight()
+    seen = []
+
+    async def work():
+        await asyncio.sleep(0.01)
+        seen.append(remaining())
+        return "done"
+
+    async def scenario():
+        short = asyncio.ensure_future(_call(flight, work, 0.5))
+        await asyncio.sleep(0)
+        long = asyncio.ensure_future(_call(flight, work, 5))
+        return await asyncio.gather(short, long)
+
+    assert asyncio.run(scenario()) == ["done", "done"]
+    assert seen[0] > 4
+
+
+def test_concurrent_callers_share_one_call_and_the_counters_show_it():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "plan"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["plan"] * 5
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert (stats["leaders"], stats["coalesced"], stats["in_flight"]) == (1, 4, 0)
+    assert stats["coalesced_rate"] == 0.8
+
+
+def test_different_keys_do_not_share_work():
+    flight = SingleFlight()
+
+    async def scenario():
+        return await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0.01, "a")),
+            flight.do("b", lambda: asyncio.sleep(0.01, "b")),
+        )
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert flight.stats()["leaders"] == 2
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["errors"] == 1
+
+
+def test_cancelling_a_waiter_leaves_the_shared_work_running_for_the_others():
+    flight, work = SingleFlight(), Work(seconds=0.05)
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do("key", work))
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader, follower = asyncio.run(scenario())
+    assert isinstance(leader, asyncio.CancelledError)
+    assert follower == "done" and not work.cancelled
+
+
+def test_a_new_call_after_completion_starts_fresh_work():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        return await flight.do("key", work), await flight.do("key", work)
+
+    assert asyncio.run(scenario()) == (1, 2)
+    assert flight.stats()["leaders"] == 2
@@ -0,0 +1,52 @@
+import asyncio
+
+import orjson
+
+from app.services import gemini_client
+from app.services.gemini_client import is_cacheable
+from app.services.llm_json import loads_object, parse_visualization
+
+COMPLETE = orjson.dumps(
+    {"title": "Heap", "elements": [{"label": "Root", "type": "box"}, {"label": "Child", "type": "box"}]}
+).decode()
+TRUNCATED = COMPLETE[: COMPLETE.index("Child") + 3]
+
+
+def test_truncated_output_is_repaired_only_when_allowed():
+    assert parse_visualization(TRUNCATED).elements[0].label == "Root"
+    assert parse_visualization(TRUNCATED, allow_truncated=False) is None
+    assert loads_object(TRUNCATED, allow_truncated=False) is None
+
+
+def test_plan_without_elements_is_rejected():
+    assert parse_visualization('{"title":"t","elements":[') is None
+    assert parse_visualization('{"title":"t","elements":[]}') is None
+
+
+def test_trailing_commas_are_not_truncation():
+    text = '```json\n{"title":"t","elements":[{"label":"a","type":"box"},]}\n```'
+    assert parse_visualization(text, allow_truncated=False) is not None
+
+
+def _generate(monkeypatch, text, finish_reason="STOP"):
+    async def fake_call(*args, **kwargs):
+        return text, finish_reason
+
+    monkeypatch.setattr(gemini_client, "_call_gemini", fake_call)
+    return asyncio.run(gemini_client._generate_two_step("heap", "Computer Science & Technology"))
+
+
+def test_complete_plan_is_cacheable(monkeypatch):
+    result = _generate(monkeypatch, COMPLETE)
+    assert not result["partial"] and is_cacheable(result)
+
+
+def test_repaired_plan_is_served_but_not_cached(monkeypatch):
+    result = _generate(monkeypatch, TRUNCATED)
+    assert not result["fallback"] and result["partial"]
+    assert not is_cacheable(result)
+
+
+def test_max_tokens_finish_marks_plan_partial(monkeypatch):
+    result = _generate(monkeypatch, COMPLETE, finish_reason="MAX_TOKENS")
+    assert result["partial"] and not is_cacheable(result)